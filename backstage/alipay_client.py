@@ -0,0 +1,72 @@
+import os
+import threading
+from zoneinfo import ZoneInfo
+
+from alipay import AliPay, AliPayConfig
+from django.conf import settings
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The gateway reads the times in trade parameters as Beijing time
+GATEWAY_TIMEZONE = ZoneInfo('Asia/Shanghai')
+_lock = threading.Lock()
+_client = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _read_key(path):
+    # Relative paths are taken from this package, not from the process working directory
+    with open(os.path.join(_BASE_DIR, path), 'r') as file:
+        return file.read()
+
+
+def build_alipay_client(alipay_public_key_string=None):
+    """
+    A new AliPay client from settings. Reads and parses both keys, use get_alipay_client() instead.
+    `alipay_public_key_string` replaces the gateway key of ALIPAY_PUBLIC_KEY_PATH.
+    """
+    return AliPay(
+        appid=_setting('ALIPAY_APPID', "9021000129661967"),
+        app_notify_url=_setting('ALIPAY_NOTIFY_URL', None),
+        app_private_key_string=_read_key(_setting('ALIPAY_PRIVATE_KEY_PATH', 'PrivateKey.txt')),
+        alipay_public_key_string=(alipay_public_key_string or
+                                  _read_key(_setting('ALIPAY_PUBLIC_KEY_PATH', 'alipayPublicCert.txt'))),
+        sign_type="RSA2",
+        debug=_setting('ALIPAY_DEBUG', True),
+        config=AliPayConfig(timeout=_setting('ALIPAY_TIMEOUT', 15))
+    )
+
+
+def get_alipay_client():
+    """
+    The process-wide AliPay client, built on first use.
+    The keys are read and parsed once per process; the client keeps no per-call state, so the views
+    and the Celery tasks share it across threads.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = build_alipay_client()
+    return _client
+
+
+def trust_gateway_key(alipay_public_key_string):
+    """
+    Replace the process-wide client by one that verifies notifications with `alipay_public_key_string`,
+    for a local stand-in of the gateway (fake_alipay_notify, tests) that signs with its own key.
+    """
+    global _client
+    with _lock:
+        _client = build_alipay_client(alipay_public_key_string)
+
+
+def payment_url(order_string):
+    return f"{_setting('ALIPAY_GATEWAY', 'https://openapi-sandbox.dl.alipaydev.com/gateway.do')}?{order_string}"
+
+
+def gateway_time(moment):
+    """An aware datetime in the yyyy-MM-dd HH:mm:ss form of the gateway, e.g. for time_expire."""
+    return moment.astimezone(GATEWAY_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
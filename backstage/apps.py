@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BackstageConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "backstage"
+
+    def ready(self):
+        import backstage.signals
@@ -0,0 +1,133 @@
+import time
+
+from django.core.cache import cache
+
+from .conditional import make_etag
+from .models import productCategory, Product
+from .serializers import ProductCategorySerializer, ProductSerializer
+
+CACHE_TIMEOUT = 60 * 60
+KEY_PREFIX = 'catalog'
+STATS_NAMESPACES = ('product', 'category')
+
+
+def _version_key(name):
+    return f'{KEY_PREFIX}:version:{name}'
+
+
+def _stats_key(namespace, outcome):
+    return f'{KEY_PREFIX}:stats:{namespace}:{outcome}'
+
+
+def _new_version():
+    # Seeded from the clock rather than 1, so a version key that was evicted never
+    # comes back with a number that still has stale entries stored under it
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    version = cache.get(_version_key(name))
+    if version is None:
+        cache.add(_version_key(name), _new_version(), timeout=None)
+        version = cache.get(_version_key(name))
+    return version
+
+
+def bump_version(name):
+    try:
+        cache.incr(_version_key(name))
+    except ValueError:
+        cache.set(_version_key(name), _new_version(), timeout=None)
+
+
+def bump_product(pk):
+    bump_version(f'product:{pk}')
+    bump_product_list()
+
+
+def bump_product_list():
+    # Any product write changes some page of the product list
+    bump_version('products')
+
+
+def bump_category(pk):
+    bump_version(f'category:{pk}')
+    bump_version('categories')
+
+
+def _count(namespace, outcome):
+    key = _stats_key(namespace, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats():
+    keys = {_stats_key(ns, outcome): (ns, outcome) for ns in STATS_NAMESPACES for outcome in ('hits', 'misses')}
+    values = cache.get_many(list(keys))
+    stats = {ns: {'hits': 0, 'misses': 0} for ns in STATS_NAMESPACES}
+    for key, (ns, outcome) in keys.items():
+        stats[ns][outcome] = values.get(key, 0)
+    return stats
+
+
+def read_through(namespace, key, version, loader):
+    """
+    Return the entry stored under `key` for `version`, calling `loader` on a miss.
+    Writers never delete entries: they bump the version, so readers simply stop finding the old ones.
+    A loader returning None (e.g. object not found) is not cached.
+    """
+    data_key = f'{KEY_PREFIX}:{namespace}:{key}:v{version}'
+    data = cache.get(data_key)
+    if data is not None:
+        _count(namespace, 'hits')
+        return data
+    _count(namespace, 'misses')
+    data = loader()
+    if data is not None:
+        cache.set(data_key, data, CACHE_TIMEOUT)
+    return data
+
+
+def _entry(data, **extra):
+    # The ETag is computed once when the entry is stored, so conditional GETs cost no hashing
+    return {'data': data, 'etag': make_etag(data), **extra}
+
+
+def get_product_entry(pk):
+    """Cached {'data', 'etag'} of product `pk`, or None when it does not exist."""
+    data_key = f'{KEY_PREFIX}:product:{pk}:v{get_version(f"product:{pk}")}'
+    entry = cache.get(data_key)
+    if entry is not None:
+        # category_name is part of the payload, so the entry is also tied to its category's version
+        category_id = entry['data']['categoryID']
+        if category_id is None or entry['category_version'] == get_version(f'category:{category_id}'):
+            _count('product', 'hits')
+            return entry
+    _count('product', 'misses')
+
+    product = Product.objects.select_related('categoryID').filter(pk=pk).first()
+    if product is None:
+        return None
+    category_version = get_version(f'category:{product.categoryID_id}') if product.categoryID_id else None
+    entry = _entry(ProductSerializer(product).data, category_version=category_version)
+    cache.set(data_key, entry, CACHE_TIMEOUT)
+    return entry
+
+
+def get_category_entry(pk):
+    """Cached {'data', 'etag'} of category `pk`, or None when it does not exist."""
+    def load():
+        category = productCategory.objects.filter(pk=pk).first()
+        return _entry(ProductCategorySerializer(category).data) if category is not None else None
+
+    return read_through('category', pk, get_version(f'category:{pk}'), load)
+
+
+def get_category_list_entry():
+    def load():
+        return _entry(ProductCategorySerializer(productCategory.objects.all(), many=True).data)
+
+    return read_through('category', 'all', get_version('categories'), load)
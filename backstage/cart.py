@@ -0,0 +1,344 @@
+import redis
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import ExpressionWrapper, F, FloatField
+from redis.exceptions import WatchError
+from rest_framework.exceptions import ValidationError
+
+from .models import Product, ShoppingCartItem
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+# A concurrent request may insert one of our lines between the lock and the bulk insert
+CONFLICT_RETRIES = 3
+
+
+def cart_item_lines(items):
+    """Cart items joined with their product and annotated with final_price = quantity * price."""
+    final_price = ExpressionWrapper(F('quantity') * F('productID__price'), output_field=FloatField())
+    return items.select_related('productID').annotate(final_price=final_price).order_by('id')
+
+
+def _parse_operation(operation):
+    """Return (op, product id, quantity) or raise ValueError with the reason."""
+    if not isinstance(operation, dict):
+        raise ValueError('Operation must be an object.')
+    op = operation.get('op')
+    if op not in CART_OPERATIONS:
+        raise ValueError(f"op must be one of {', '.join(CART_OPERATIONS)}.")
+    try:
+        product_id = int(operation.get('productID'))
+        quantity = int(operation.get('quantity', 1)) if op != 'remove' else 0
+    except (TypeError, ValueError):
+        raise ValueError('productID and quantity must be integers.')
+    if op != 'remove' and quantity < 1:
+        raise ValueError('Quantity cannot be less than 1.')
+    return op, product_id, quantity
+
+
+def apply_cart_operations(cart_id, operations):
+    """
+    Apply a list of add / set / remove operations to a cart and return one result per operation.
+    All referenced products and cart lines are read with one IN query each, the operations are checked
+    against the stock in memory, in order, and the outcome is written with at most one bulk insert,
+    one bulk update and one delete inside a single transaction. Invalid operations are reported and
+    skipped, the others are applied.
+    """
+    for attempt in range(CONFLICT_RETRIES):
+        try:
+            with transaction.atomic():
+                return _apply(cart_id, operations)
+        except IntegrityError:
+            if attempt == CONFLICT_RETRIES - 1:
+                raise
+
+
+def _parse_operations(operations):
+    parsed = []
+    for operation in operations:
+        try:
+            parsed.append(_parse_operation(operation))
+        except ValueError as e:
+            parsed.append(str(e))
+    return parsed
+
+
+def _product_ids(parsed):
+    return {operation[1] for operation in parsed if isinstance(operation, tuple)}
+
+
+def _load_availability(product_ids):
+    """{product id: available units} of the existing products among `product_ids`, in one query."""
+    rows = Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock', 'reserved')
+    return {pk: stock - reserved for pk, stock, reserved in rows}
+
+
+def _evaluate(parsed, quantities, availability):
+    """Check the parsed operations in order against the available stock, updating `quantities` in place."""
+    results = []
+    for index, operation in enumerate(parsed):
+        if isinstance(operation, str):
+            results.append({'index': index, 'status': 'error', 'error': operation})
+            continue
+        op, product_id, quantity = operation
+        result = {'index': index, 'productID': product_id}
+        results.append(result)
+        available = availability.get(product_id)
+        current = quantities.get(product_id, 0)
+
+        if available is None:
+            result.update(status='error', error='Product does not exist.')
+            continue
+        if op == 'remove':
+            if not current:
+                result.update(status='error', error='Product is not in the cart.')
+                continue
+            quantities[product_id] = 0
+            result.update(status='ok', quantity=0)
+            continue
+
+        new_quantity = current + quantity if op == 'add' else quantity
+        if new_quantity > available:
+            result.update(status='error',
+                          error=f'Quantity cannot exceed the stock available. Stock available: {available}.')
+            continue
+        quantities[product_id] = new_quantity
+        result.update(status='ok', quantity=new_quantity)
+    return results
+
+
+def _write_lines(cart_id, lines, quantities):
+    """Bring the (locked) cart `lines` to `quantities` with one bulk insert, one bulk update and one delete."""
+    to_create, to_update, to_delete = [], [], []
+    for product_id, quantity in quantities.items():
+        line = lines.get(product_id)
+        if line is None:
+            if quantity:
+                to_create.append(ShoppingCartItem(cartID_id=cart_id, productID_id=product_id, quantity=quantity))
+        elif not quantity:
+            to_delete.append(line.pk)
+        elif quantity != line.quantity:
+            line.quantity = quantity
+            to_update.append(line)
+
+    ShoppingCartItem.objects.bulk_create(to_create)
+    ShoppingCartItem.objects.bulk_update(to_update, ['quantity'])
+    if to_delete:
+        ShoppingCartItem.objects.filter(pk__in=to_delete).delete()
+
+
+def _apply(cart_id, operations):
+    parsed = _parse_operations(operations)
+    availability = _load_availability(_product_ids(parsed))
+    lines = {line.productID_id: line for line in
+             ShoppingCartItem.objects.select_for_update().filter(cartID_id=cart_id, productID_id__in=availability)}
+    quantities = {product_id: line.quantity for product_id, line in lines.items()}
+    results = _evaluate(parsed, quantities, availability)
+    _write_lines(cart_id, lines, quantities)
+    return results
+
+
+class DatabaseCartStore:
+    """Carts kept only in ShoppingCartItem rows."""
+
+    def add(self, cart_id, product_id, quantity):
+        ShoppingCartItem.add_to_cart(cart_id, product_id, quantity)
+
+    def set(self, item, quantity):
+        item.set_quantity(quantity)
+
+    def remove(self, item):
+        item.delete()
+
+    def apply(self, cart_id, operations):
+        return apply_cart_operations(cart_id, operations)
+
+    def flush(self, cart_id):
+        return False
+
+    def clear(self, cart_id):
+        pass
+
+
+# Adds to a loaded cart hash when the product's availability is in Redis too, in one round trip.
+# KEYS: cart hash, dirty set, product availability. ARGV: product id, quantity, cart id, hash TTL.
+# Returns {1, new quantity}, {0, available units} when the stock does not cover it, or {-1, 0} when the
+# hash or the availability has to be loaded first.
+ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {-1, 0} end
+local available = redis.call('GET', KEYS[3])
+if not available then return {-1, 0} end
+available = tonumber(available)
+local quantity = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0') + tonumber(ARGV[2])
+if quantity > available then return {0, available} end
+redis.call('HSET', KEYS[1], ARGV[1], quantity)
+redis.call('SADD', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return {1, quantity}
+"""
+
+
+class RedisCartStore:
+    """
+    Carts kept in one Redis hash each (product id -> quantity), written back to ShoppingCartItem later.
+    A hash is loaded from the database on first use, changed under WATCH (or by ADD_SCRIPT) so concurrent
+    requests cannot lose each other's updates, and its cart id is added to a dirty set. Dirty carts are
+    written back by the flush_dirty_carts task, and synchronously by flush() whenever the rows are needed:
+    before the cart is read and at checkout.
+    The available units of each product are kept in Redis for `availability_ttl` seconds, so changes to a
+    loaded cart do not reach the database at all. A cart may therefore briefly accept units sold a moment
+    ago; the checkout locks the products and refuses what the stock no longer covers.
+    Any redis-py compatible client with scripting works, e.g. fakeredis with lupa in tests.
+    """
+    dirty_key = 'cart:dirty'
+    # Marks a loaded hash, so that a cart emptied in Redis is not reloaded from stale rows
+    loaded_field = '_'
+    ttl = 24 * 60 * 60
+    availability_ttl = 5
+
+    def __init__(self, client):
+        self.client = client
+        self._add_script = client.register_script(ADD_SCRIPT)
+
+    def _key(self, cart_id):
+        return f'cart:{cart_id}:lines'
+
+    def _availability_key(self, product_id):
+        return f'cart:available:{product_id}'
+
+    def _availability(self, product_ids):
+        """{product id: available units}, from Redis; only the products missing there are read from the database."""
+        product_ids = list(product_ids)
+        if not product_ids:
+            return {}
+        cached = self.client.mget([self._availability_key(pk) for pk in product_ids])
+        availability = {pk: int(value) for pk, value in zip(product_ids, cached) if value is not None}
+        missing = [pk for pk in product_ids if pk not in availability]
+        if missing:
+            loaded = _load_availability(missing)
+            pipe = self.client.pipeline(transaction=False)
+            for pk, available in loaded.items():
+                pipe.set(self._availability_key(pk), available, ex=self.availability_ttl)
+            pipe.execute()
+            availability.update(loaded)
+        return availability
+
+    def add(self, cart_id, product_id, quantity):
+        if quantity >= 1:
+            outcome, value = self._add_script(
+                keys=[self._key(cart_id), self.dirty_key, self._availability_key(product_id)],
+                args=[product_id, quantity, cart_id, self.ttl])
+            if outcome == 1:
+                return
+            if outcome == 0:
+                raise ValidationError(f'Quantity cannot exceed the stock available. Stock available: {value}.')
+        # Loads the cart and the availability, the next adds take the script path
+        self._single(cart_id, {'op': 'add', 'productID': product_id, 'quantity': quantity})
+
+    def set(self, item, quantity):
+        self._single(item.cartID_id, {'op': 'set', 'productID': item.productID_id, 'quantity': quantity})
+
+    def remove(self, item):
+        self._single(item.cartID_id, {'op': 'remove', 'productID': item.productID_id})
+
+    def _single(self, cart_id, operation):
+        result = self.apply(cart_id, [operation])[0]
+        if result['status'] != 'ok':
+            raise ValidationError(result['error'])
+
+    def apply(self, cart_id, operations):
+        parsed = _parse_operations(operations)
+        availability = self._availability(_product_ids(parsed))
+        key = self._key(cart_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    stored = pipe.hgetall(key)
+                    if stored:
+                        loaded = {}
+                        quantities = {int(field): int(value) for field, value in stored.items()
+                                      if field.decode() != self.loaded_field}
+                    else:
+                        loaded = dict(ShoppingCartItem.objects.filter(cartID_id=cart_id)
+                                      .values_list('productID_id', 'quantity'))
+                        quantities = dict(loaded)
+                    previous = dict(quantities)
+                    results = _evaluate(parsed, quantities, availability)
+
+                    pipe.multi()
+                    if not stored:
+                        pipe.hset(key, mapping={self.loaded_field: 1, **loaded})
+                    changed = False
+                    for product_id, quantity in quantities.items():
+                        if quantity == previous.get(product_id, 0):
+                            continue
+                        changed = True
+                        if quantity:
+                            pipe.hset(key, product_id, quantity)
+                        else:
+                            pipe.hdel(key, product_id)
+                    if changed:
+                        pipe.sadd(self.dirty_key, cart_id)
+                    pipe.expire(key, self.ttl)
+                    pipe.execute()
+                    return results
+                except WatchError:
+                    continue
+
+    def flush(self, cart_id):
+        """Write a dirty cart back to its rows. Returns whether anything had to be written."""
+        # Taken off the dirty set first: a change made while we write marks it dirty again
+        if not self.client.srem(self.dirty_key, cart_id):
+            return False
+        self._write_back(cart_id)
+        return True
+
+    def flush_dirty(self, batch_size=100):
+        """Write back every dirty cart, returns how many were written."""
+        flushed = 0
+        while True:
+            cart_ids = self.client.spop(self.dirty_key, batch_size)
+            if not cart_ids:
+                return flushed
+            for cart_id in cart_ids:
+                self._write_back(int(cart_id))
+                flushed += 1
+
+    def _write_back(self, cart_id):
+        try:
+            stored = self.client.hgetall(self._key(cart_id))
+            if not stored:
+                # Cleared at checkout, or expired: the rows are all there is
+                return
+            quantities = {int(field): int(value) for field, value in stored.items()
+                          if field.decode() != self.loaded_field}
+            with transaction.atomic():
+                lines = {line.productID_id: line for line in
+                         ShoppingCartItem.objects.select_for_update().filter(cartID_id=cart_id)}
+                for product_id in lines:
+                    quantities.setdefault(product_id, 0)
+                _write_lines(cart_id, lines, quantities)
+        except Exception:
+            self.client.sadd(self.dirty_key, cart_id)
+            raise
+
+    def clear(self, cart_id):
+        """Forget a cart whose rows were just deleted (checkout)."""
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(cart_id))
+        pipe.srem(self.dirty_key, cart_id)
+        pipe.execute()
+
+
+_cart_store = None
+
+
+def get_cart_store():
+    """The cart store selected by settings.CART_BACKEND ('database' or 'redis')."""
+    global _cart_store
+    if _cart_store is None:
+        if getattr(settings, 'CART_BACKEND', 'database') == 'redis':
+            _cart_store = RedisCartStore(redis.Redis.from_url(settings.CART_REDIS_URL))
+        else:
+            _cart_store = DatabaseCartStore()
+    return _cart_store
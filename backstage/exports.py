@@ -0,0 +1,56 @@
+import csv
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .iterators import iterate_in_batches
+from .models import Order, OrderExportJob
+from .orders import order_filter
+
+EXPORT_FIELDS = ['id', 'user', 'status', 'isPaid', 'totalCost', 'createTime', 'finishTime', 'item', 'address']
+JSON_FIELDS = ('item', 'address')
+BATCH_SIZE = 2000
+
+
+def export_path(job):
+    return os.path.join(settings.EXPORT_ROOT, job.file_name)
+
+
+def _csv_value(field, value):
+    if field in JSON_FIELDS:
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+def run_order_export(job_id):
+    """
+    Write the orders matching the job's filters to a gzip-compressed CSV under settings.EXPORT_ROOT.
+    Rows are read in primary key batches and written straight to the compressed file, so memory stays
+    flat whatever the size of the export; `rows` is updated after every batch for progress reporting.
+    """
+    job = OrderExportJob.objects.get(pk=job_id)
+    job.file_name = f'orders-{job.pk}.csv.gz'
+    orders = Order.objects.filter(order_filter(**job.filters))
+    OrderExportJob.objects.filter(pk=job.pk).update(status='running', file_name=job.file_name, total=orders.count())
+
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    written = 0
+    try:
+        with gzip.open(export_path(job), 'wt', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_FIELDS)
+            for row in iterate_in_batches(orders.values(*EXPORT_FIELDS), BATCH_SIZE):
+                writer.writerow([_csv_value(field, row[field]) for field in EXPORT_FIELDS])
+                written += 1
+                if written % BATCH_SIZE == 0:
+                    OrderExportJob.objects.filter(pk=job.pk).update(rows=written)
+    except Exception as e:
+        OrderExportJob.objects.filter(pk=job.pk).update(status='failed', rows=written, error=str(e),
+                                                        finishTime=timezone.now())
+        raise
+    OrderExportJob.objects.filter(pk=job.pk).update(status='done', rows=written, finishTime=timezone.now())
+    return written
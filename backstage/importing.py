@@ -0,0 +1,165 @@
+import csv
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump_product, bump_product_list
+from .models import productCategory, Product
+from .search import product_indexes
+from .serializers import ProductSerializer
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+# Empty CSV cells of these columns are read as null
+NULLABLE_FIELDS = ['description', 'url']
+
+
+class ProductImportSerializer(ProductSerializer):
+    """
+    ProductSerializer rules for one import row.
+    The category comes in by name and is resolved by the importer, so the relation is left out here
+    and validating a row costs no query.
+    """
+    class Meta(ProductSerializer.Meta):
+        fields = None
+        exclude = ['categoryID']
+
+
+class CategoryLookup:
+    """Category name -> id, loaded once and completed on demand for names created meanwhile."""
+
+    def __init__(self):
+        self._ids = None
+
+    def get(self, name):
+        if self._ids is None:
+            self._ids = dict(productCategory.objects.values_list('name', 'id'))
+        if name not in self._ids:
+            self._ids[name] = productCategory.objects.filter(name=name).values_list('id', flat=True).first()
+        return self._ids[name]
+
+
+def read_rows(stream, file_format):
+    """Yield (line number, row) from a CSV or NDJSON text stream, one line at a time."""
+    if file_format == 'csv':
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row
+        return
+    for line, text in enumerate(stream, start=1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError:
+            yield line, None
+
+
+def _build_product(row, categories):
+    """
+    Return (Product, supplied fields, None) for a valid row or (None, None, errors).
+    A row with an id updates that product, so only the columns it supplies are validated and written.
+    """
+    if not isinstance(row, dict):
+        return None, None, {'row': ['Invalid JSON object.']}
+    row = dict(row)
+    pk = row.pop('id', None) or None
+    has_category = 'categoryID' in row or 'category' in row
+    category_name = row.pop('categoryID', None) or row.pop('category', None)
+    for field in NULLABLE_FIELDS:
+        # CSV cannot express null, an empty cell means no value
+        if row.get(field) == '':
+            row[field] = None
+
+    serializer = ProductImportSerializer(data=row, partial=pk is not None)
+    if not serializer.is_valid():
+        return None, None, serializer.errors
+
+    category_id = None
+    if category_name:
+        category_id = categories.get(category_name)
+        if category_id is None:
+            return None, None, {'categoryID': [f'Category "{category_name}" does not exist.']}
+    try:
+        pk = int(pk) if pk is not None else None
+    except (TypeError, ValueError):
+        return None, None, {'id': ['A valid integer is required.']}
+    fields = set(serializer.validated_data)
+    if has_category:
+        fields.add('categoryID')
+    return Product(pk=pk, categoryID_id=category_id, **serializer.validated_data), fields, None
+
+
+def _write_batch(batch, on_error):
+    now = timezone.now()
+    for product, _, _ in batch:
+        product.updated_at = now
+
+    with transaction.atomic():
+        ids = [product.pk for product, _, _ in batch if product.pk is not None]
+        existing = set(Product.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        to_create, to_update = [], {}
+        for product, line, fields in batch:
+            if product.pk is None:
+                to_create.append(product)
+            elif product.pk in existing:
+                # Rows supplying the same columns are updated together, and only those columns are written
+                to_update.setdefault(frozenset(fields), []).append(product)
+            else:
+                on_error(line, {'id': [f'Product {product.pk} does not exist.']})
+        Product.objects.bulk_create(to_create)
+        for fields, products in to_update.items():
+            Product.objects.bulk_update(products, sorted(fields) + ['updated_at'])
+
+    # Bulk writes send no model signals, keep the cache in step by hand
+    updated = [product for products in to_update.values() for product in products]
+    for product in updated:
+        bump_product(product.pk)
+    if to_create:
+        bump_product_list()
+    names_changed = bool(to_create) or any('name' in fields for fields in to_update)
+    return len(to_create), len(updated), names_changed
+
+
+def import_products(rows, on_error, batch_size=1000):
+    """
+    Validate and write products from an iterable of (line number, row).
+    Rows with an id update the columns they supply on that product, rows without one are created. Every batch is written with
+    bulk_create / bulk_update in its own transaction, so memory stays bounded by `batch_size`
+    whatever the size of the input. `on_error(line, errors)` is called once per rejected row.
+    Returns a summary {'created', 'updated', 'failed'}.
+    """
+    categories = CategoryLookup()
+    summary = {'created': 0, 'updated': 0, 'failed': 0}
+    names_changed = False
+
+    def reject(line, errors):
+        summary['failed'] += 1
+        on_error(line, errors)
+
+    def write(batch):
+        nonlocal names_changed
+        created, updated, changed = _write_batch(batch, reject)
+        summary['created'] += created
+        summary['updated'] += updated
+        names_changed = names_changed or changed
+
+    batch = []
+    for line, row in rows:
+        product, fields, errors = _build_product(row, categories)
+        if errors:
+            reject(line, errors)
+            continue
+        batch.append((product, line, fields))
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+
+    if names_changed:
+        # The importer may run in another process than the web workers (manage.py import_products):
+        # the shared invalidation has every process rebuild its search indexes
+        for index in product_indexes:
+            index.invalidate()
+    return summary
@@ -0,0 +1,17 @@
+def iterate_in_batches(queryset, batch_size=2000):
+    """
+    Yield the rows of `queryset` in primary key order, fetching `batch_size` rows per query
+    with `WHERE id > <last id>`.
+    QuerySet.iterator() does not stream on MySQL (the driver buffers the whole result set), this does.
+    Querysets built with values() must include 'id'.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(page[:batch_size])
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1]
+        last_pk = last['id'] if isinstance(last, dict) else last.pk
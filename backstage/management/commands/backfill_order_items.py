@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from backstage.orders import backfill_order_items
+
+
+class Command(BaseCommand):
+    help = "Fill the OrderItem table from the Order.item JSON of existing orders, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        summary = backfill_order_items(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {summary['orders']} orders, {summary['items']} order items."))
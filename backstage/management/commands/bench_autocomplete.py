@@ -0,0 +1,74 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backstage.models import Product
+from backstage.search import ProductAutocomplete
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _name(rng):
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))) for _ in range(rng.randint(1, 3))]
+    return ' '.join(words)
+
+
+def _percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Measure the latency of product name completion on a synthetic catalog: prefixes of one to six "
+            "letters of random names, as typed one keystroke at a time. The rows are inserted in a transaction "
+            "that is rolled back. The cache configured for the shared index version is used as is.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200000)
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--scan-limit', type=int, default=ProductAutocomplete.scan_limit,
+                            help="Longest prefix slice ranked per query instead of at build time.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._bench(options['size'], options['queries'], options['scan_limit'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _bench(self, size, queries, scan_limit):
+        rng = random.Random(size)
+        names = [_name(rng) for _ in range(size)]
+        for start in range(0, size, 5000):
+            Product.objects.bulk_create([Product(name=name, price=1, stock=1) for name in names[start:start + 5000]])
+
+        index = ProductAutocomplete()
+        index.scan_limit = scan_limit
+        start = time.perf_counter()
+        index.load()
+        self.stdout.write(f"{size} products: build {time.perf_counter() - start:.2f}s, "
+                          f"{len(index._state.top)} long prefixes ranked")
+
+        prefixes = []
+        while len(prefixes) < queries:
+            name = rng.choice(names)
+            prefixes.extend(name[:length] for length in range(1, min(6, len(name)) + 1))
+        prefixes = prefixes[:queries]
+
+        for label, check_interval in (('version checked every call', 0),
+                                      (f'version checked every {index.version_check_interval}s',
+                                       index.version_check_interval)):
+            index.version_check_interval = check_interval
+            timings = []
+            for prefix in prefixes:
+                start = time.perf_counter()
+                index.complete(prefix)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(f"{label:>30}: p50 {_percentile(timings, 0.5):.3f} ms, "
+                              f"p99 {_percentile(timings, 0.99):.3f} ms, max {timings[-1]:.3f} ms")
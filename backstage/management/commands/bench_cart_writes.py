@@ -0,0 +1,67 @@
+import time
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backstage.cart import DatabaseCartStore, RedisCartStore
+from backstage.models import Product, ShoppingCart, ShoppingCartItem
+from eShop.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = ("Measure add-to-cart throughput of the database cart store and of the Redis cart store, and the "
+            "time the Redis store takes to write the dirty carts back. Every add commits on its own, as in a "
+            "request; the benchmark carts, products and Redis keys are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=200)
+        parser.add_argument('--adds', type=int, default=20, help="Adds per cart, spread over as many products.")
+        parser.add_argument('--redis-url', default=getattr(settings, 'CART_REDIS_URL', 'redis://127.0.0.1:6379/2'))
+        parser.add_argument('--fake', action='store_true', help="Use an in-process fakeredis server.")
+
+    def handle(self, *args, **options):
+        if options['fake']:
+            import fakeredis
+            client = fakeredis.FakeRedis()
+        else:
+            client = redis.Redis.from_url(options['redis_url'])
+        carts, adds = options['carts'], options['adds']
+        # One by one: bulk_create does not return the primary keys on MySQL
+        users = [CustomUser.objects.create_user(email=f'bench-cart-{n}@example.com', username=f'bench-cart-{n}')
+                 for n in range(carts)]
+        cart_ids = [ShoppingCart.objects.get_or_create(userID=user)[0].id for user in users]
+        product_ids = [Product.objects.create(name=f'Bench product {n}', price=1, stock=carts * adds).id
+                       for n in range(adds)]
+        try:
+            self._bench(client, cart_ids, product_ids)
+        finally:
+            ShoppingCartItem.objects.filter(cartID_id__in=cart_ids).delete()
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Product.objects.filter(pk__in=product_ids).delete()
+
+    def _bench(self, client, cart_ids, product_ids):
+        carts, adds = len(cart_ids), len(product_ids)
+
+        def timed(store):
+            start = time.perf_counter()
+            for cart_id in cart_ids:
+                for product_id in product_ids:
+                    store.add(cart_id, product_id, 1)
+            return carts * adds / (time.perf_counter() - start)
+
+        database = timed(DatabaseCartStore())
+        ShoppingCartItem.objects.filter(cartID_id__in=cart_ids).delete()
+        self.stdout.write(f"database: {database:.0f} adds/s")
+
+        store = RedisCartStore(client)
+        try:
+            cached = timed(store)
+            start = time.perf_counter()
+            flushed = store.flush_dirty()
+            flush = time.perf_counter() - start
+        finally:
+            client.delete(*[store._key(cart_id) for cart_id in cart_ids])
+            client.srem(store.dirty_key, *cart_ids)
+        self.stdout.write(f"   redis: {cached:.0f} adds/s, write-back of {flushed} carts {flush:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up of the adds: {cached / database:.1f}x"))
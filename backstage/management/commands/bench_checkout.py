@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from backstage.models import Address, Order, Product, ShoppingCart, ShoppingCartItem
+from backstage.rollups import rebuild_rollups
+from eShop.models import CustomUser
+
+PRODUCTS = 50
+
+
+class Command(BaseCommand):
+    help = ("Measure checkout throughput in orders per second: customers with a filled cart check out "
+            "concurrently through the order endpoint, in-process. 'spread' carts draw from 50 products, 'hot' "
+            "carts all contain the same product, so every checkout queues on its row lock. The benchmark "
+            "rows are deleted afterwards and the rollups rebuilt, run it against a test or staging database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--lines', type=int, default=3, help="Products per cart.")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent checkouts.")
+
+    def handle(self, *args, **options):
+        for scenario in ('spread', 'hot'):
+            products = [Product.objects.create(name=f'Bench checkout {n}', price=1, stock=options['customers'] *
+                                               options['lines']) for n in range(PRODUCTS)]
+            customers = []
+            try:
+                customers = self._customers(options['customers'], options['lines'], products, scenario == 'hot')
+                seconds, created = self._checkout(customers, options['workers'])
+                self.stdout.write(f"{scenario:>6}: {created} orders in {seconds:.2f}s, {created / seconds:.1f} orders/s "
+                                  f"with {options['workers']} workers")
+            finally:
+                users = [user for user, _, _ in customers]
+                ShoppingCartItem.objects.filter(cartID__userID__in=users).delete()
+                Order.objects.filter(user__in=users).delete()
+                CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+                Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+        rebuild_rollups()
+
+    def _customers(self, count, lines, products, hot):
+        customers = []
+        for n in range(count):
+            user = CustomUser.objects.create_user(email=f'bench-checkout-{n}@example.com',
+                                                  username=f'bench-checkout-{n}')
+            cart, _ = ShoppingCart.objects.get_or_create(userID=user)
+            address = Address.objects.create(user=user, house_number_and_street='1 Bench Street', town='Glasgow',
+                                             postcode='G1 1AA')
+            picks = [0] + [(n + i) % (len(products) - 1) + 1 for i in range(lines - 1)] if hot else \
+                [(n * lines + i) % len(products) for i in range(lines)]
+            ShoppingCartItem.objects.bulk_create([
+                ShoppingCartItem(cartID=cart, productID=products[i], quantity=1) for i in picks])
+            customers.append((user, Token.objects.create(user=user).key, address.id))
+        return customers
+
+    def _checkout(self, customers, workers):
+        created = [0] * workers
+
+        def run(worker):
+            client = Client()
+            try:
+                for user, token, address_id in customers[worker::workers]:
+                    response = client.post(reverse('order-create', args=[user.id]), json.dumps({'address_id': address_id}),
+                                           content_type='application/json', HTTP_AUTHORIZATION=f'Token {token}',
+                                           HTTP_HOST='localhost')
+                    created[worker] += response.status_code == 201
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, sum(created)
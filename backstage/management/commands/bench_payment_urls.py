@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backstage.alipay_client import build_alipay_client, get_alipay_client
+
+
+def _page_pay(client, i):
+    return client.api_alipay_trade_page_pay(out_trade_no=i, total_amount="9.99", subject="P",
+                                            return_url=None, notify_url=None)
+
+
+class Command(BaseCommand):
+    help = ("Measure payment URL generation throughput with a client built per call (the old behaviour) "
+            "and with the shared client. Signs locally, no request is sent to the gateway.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        results = {}
+        for label, client_for in (('per call', build_alipay_client),
+                                  ('shared', get_alipay_client)):
+            client_for()
+            start = time.perf_counter()
+            for i in range(iterations):
+                _page_pay(client_for(), i)
+            results[label] = iterations / (time.perf_counter() - start)
+            self.stdout.write(f"{label:>8}: {results[label]:.1f} URLs/s")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {results['shared'] / results['per call']:.1f}x"))
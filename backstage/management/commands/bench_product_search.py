@@ -0,0 +1,65 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backstage.models import Product
+from backstage.search import ProductNameIndex
+
+QUERIES = ('app', 'ban', 'xyz', 'ing', 'orange juice')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _name(rng):
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))) for _ in range(rng.randint(1, 3))]
+    return ' '.join(words)
+
+
+class Command(BaseCommand):
+    help = ("Compare product name search through the n-gram index with the name__icontains query, on "
+            "synthetic catalogs of the given sizes. The rows are inserted in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    self._bench(size, options['repeat'])
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+    def _bench(self, size, repeat):
+        rng = random.Random(size)
+        batch = []
+        for _ in range(size):
+            batch.append(Product(name=_name(rng), price=1, stock=1))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+
+        index = ProductNameIndex()
+        start = time.perf_counter()
+        index.load()
+        build = time.perf_counter() - start
+
+        def timed(search):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for query in QUERIES:
+                    search(query)
+            return (time.perf_counter() - start) / (repeat * len(QUERIES)) * 1000
+
+        orm = timed(lambda query: list(Product.objects.filter(name__icontains=query).values_list('id', flat=True)))
+        indexed = timed(index.search)
+        self.stdout.write(f"{size:>9} products: build {build:.2f}s, icontains {orm:.2f} ms/query, "
+                          f"index {indexed:.2f} ms/query")
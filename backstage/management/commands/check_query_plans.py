@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from backstage.models import Order, OrderItem, ShoppingCartItem
+from backstage.orders import order_filter
+
+SAMPLE_FILTERS = {
+    'user orders': dict(user_id=1),
+    'user orders by status and date': dict(user_id=1, statuses=['unpaid', 'processing'],
+                                           start_date='2024-01-01', end_date='2024-02-28'),
+    'manager orders by status': dict(statuses=['processing']),
+    'manager orders by status and date': dict(statuses=['unpaid', 'processing'],
+                                              start_date='2024-01-01', end_date='2024-02-28'),
+    'manager orders by date': dict(start_date='2024-01-01', end_date='2024-02-28'),
+}
+
+# MySQL access types that read every row of the table or of one of its indexes
+FULL_SCAN_ACCESS_TYPES = ('ALL', 'index')
+
+
+def _querysets():
+    for label, filters in SAMPLE_FILTERS.items():
+        yield label, Order.objects.filter(order_filter(**filters)).order_by('id')
+    yield 'order items of a product', OrderItem.objects.filter(product_id=1)
+    yield 'cart items of a product', ShoppingCartItem.objects.filter(productID_id=1)
+
+
+def _mysql_full_scans(plan):
+    """Tables read in full in a MySQL JSON plan: a table scan (ALL) or a full index scan (index)."""
+    found = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') in FULL_SCAN_ACCESS_TYPES:
+                found.append(node.get('table_name'))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(plan))
+    return found
+
+
+def _sqlite_full_scans(plan):
+    """Tables read with a plain SCAN (no index) in a SQLite query plan."""
+    found = []
+    for line in plan.splitlines():
+        words = line.split()
+        if 'SCAN' in words and 'INDEX' not in words:
+            found.append(' '.join(words[words.index('SCAN') + 1:]))
+    return found
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the order and cart querysets built by the API filters and fail if any of them "
+            "reads a table with a full scan. Run it against a database with production-like volumes: "
+            "on a nearly empty table the optimizer may prefer a scan regardless of the indexes.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'mysql':
+            explain, full_scans = (lambda qs: qs.explain(format='json')), _mysql_full_scans
+        elif connection.vendor == 'sqlite':
+            explain, full_scans = (lambda qs: qs.explain()), _sqlite_full_scans
+        else:
+            raise CommandError(f"Query plans cannot be checked on {connection.vendor}.")
+
+        failures = []
+        for label, queryset in _querysets():
+            plan = explain(queryset)
+            scanned = full_scans(plan)
+            if scanned:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {label}: {', '.join(map(str, scanned))}"))
+                self.stdout.write(plan)
+            else:
+                self.stdout.write(f"ok         {label}")
+
+        if failures:
+            raise CommandError(f"{len(failures)} queries fall back to a full scan.")
+        self.stdout.write(self.style.SUCCESS("Every query uses an index."))
@@ -0,0 +1,60 @@
+import base64
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Signature import PKCS1_v1_5
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from backstage.alipay_client import trust_gateway_key
+from backstage.models import Order
+
+
+def sign_notification(params, private_key):
+    """Sign notification parameters the way the gateway does: RSA2 over the sorted k=v pairs."""
+    message = "&".join(f"{key}={value}" for key, value in sorted(params.items())
+                       if key not in ("sign", "sign_type"))
+    signature = PKCS1_v1_5.new(private_key).sign(SHA256.new(message.encode("utf-8")))
+    return base64.b64encode(signature).decode("utf-8")
+
+
+class Command(BaseCommand):
+    help = ("Act as a local AliPay gateway: sign a trade notification for an order with --gateway-key and post "
+            "it to the notify endpoint in-process, without any network. The endpoint of this process trusts the "
+            "public half of --gateway-key, the settings are left alone.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_id', type=int)
+        parser.add_argument('--gateway-key', required=True, help="PEM private key playing the gateway's key.")
+        parser.add_argument('--trade-status', default="TRADE_SUCCESS")
+        parser.add_argument('--amount', help="total_amount to report, the order total by default.")
+
+    def handle(self, *args, **options):
+        order = Order.objects.filter(pk=options['order_id']).first()
+        if order is None:
+            raise CommandError(f"Order {options['order_id']} does not exist.")
+        with open(options['gateway_key']) as file:
+            private_key = RSA.import_key(file.read())
+        trust_gateway_key(private_key.publickey().export_key().decode())
+
+        params = {
+            "app_id": settings.ALIPAY_APPID,
+            "charset": "utf-8",
+            "notify_time": timezone.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "notify_type": "trade_status_sync",
+            "out_trade_no": str(order.pk),
+            "total_amount": options['amount'] or f"{order.totalCost:.2f}",
+            "trade_no": f"FAKE{order.pk:012d}",
+            "trade_status": options['trade_status'],
+            "version": "1.0",
+        }
+        params["sign"] = sign_notification(params, private_key)
+        params["sign_type"] = "RSA2"
+
+        response = Client().post(reverse('alipay-notify'), params, HTTP_HOST='localhost')
+        self.stdout.write(f"{response.status_code} {response.content.decode()}")
+        order.refresh_from_db()
+        self.stdout.write(f"Order {order.pk}: status {order.status}, paid {order.isPaid}")
@@ -0,0 +1,42 @@
+import csv
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backstage.importing import IMPORT_FORMATS, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = "Stream products from a CSV or NDJSON file into the catalog in bulk batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file to import.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help="File format, guessed from the extension when omitted.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help="Write the per-row error report (CSV) here instead of stderr.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+
+        report_file = open(options['errors'], 'w', newline='') if options['errors'] else sys.stderr
+        try:
+            report = csv.writer(report_file)
+            report.writerow(['line', 'errors'])
+
+            def on_error(line, errors):
+                report.writerow([line, json.dumps(errors)])
+
+            with open(path, newline='', encoding='utf-8-sig') as stream:
+                summary = import_products(read_rows(stream, file_format), on_error, options['batch_size'])
+        finally:
+            if report_file is not sys.stderr:
+                report_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']}, updated {summary['updated']}, failed {summary['failed']}."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from backstage.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily order and product sales rollups from the order history."
+
+    def handle(self, *args, **options):
+        order_rows, product_rows = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {order_rows} daily status rows and {product_rows} daily product rows."))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2024-03-19 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("backstage", "0007_product_updated_at_order_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["categoryID", "price", "stock"], name="product_facet_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.10 on 2024-03-20 16:12
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold duplicate (cart, product) lines into the oldest one so the constraint can be added."""
+    ShoppingCartItem = apps.get_model("backstage", "ShoppingCartItem")
+    duplicates = (
+        ShoppingCartItem.objects.values("cartID", "productID")
+        .annotate(lines=Count("id"), first_id=Min("id"), total=Sum("quantity"))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        ShoppingCartItem.objects.filter(pk=duplicate["first_id"]).update(
+            quantity=duplicate["total"]
+        )
+        ShoppingCartItem.objects.filter(
+            cartID=duplicate["cartID"], productID=duplicate["productID"]
+        ).exclude(pk=duplicate["first_id"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("backstage", "0008_product_product_facet_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="shoppingcartitem",
+            constraint=models.UniqueConstraint(
+                fields=("cartID", "productID"), name="unique_cart_product"
+            ),
+        ),
+    ]
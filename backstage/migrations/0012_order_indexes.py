@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2024-03-26 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("backstage", "0011_orderitem"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "createTime"], name="order_user_create_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "createTime"], name="order_status_create_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["createTime"], name="order_create_idx"),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.10 on 2024-03-28 11:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("backstage", "0013_dailyorderrollup_dailyproductsales"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderExportJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("filters", models.JSONField(default=dict)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("rows", models.IntegerField(default=0, verbose_name="Rows Written")),
+                (
+                    "total",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Rows To Write"
+                    ),
+                ),
+                ("file_name", models.CharField(blank=True, max_length=255)),
+                ("error", models.TextField(blank=True)),
+                (
+                    "createTime",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Create Time"),
+                ),
+                (
+                    "finishTime",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Finish Time"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="order_exports",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
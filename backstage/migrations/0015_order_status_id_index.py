@@ -0,0 +1,16 @@
+# Generated by Django 4.2.10 on 2026-10-17 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("backstage", "0014_orderexportjob"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["status", "id"], name="order_status_id_idx"),
+        ),
+    ]
@@ -1,5 +1,5 @@
-from django.db import models, transaction
-from django.db.models import F
+from django.db import models, connection, transaction
+from django.db.models import Exists, F
 from rest_framework.exceptions import ValidationError
 
 from eShop.models import CustomUser
@@ -21,10 +21,23 @@ class Product(models.Model):
     stock = models.IntegerField(10)
     description = models.TextField(null=True)
     url = models.TextField(null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Units held by unpaid orders, maintained by backstage.reservations
+    reserved = models.IntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    @property
+    def available_stock(self):
+        return self.stock - self.reserved
+
+    class Meta:
+        indexes = [
+            # Covers the faceted search aggregate, which groups by category and counts by price and available stock
+            models.Index(fields=['categoryID', 'price', 'stock', 'reserved'], name='product_facet_idx'),
+        ]
+
 class ShoppingCart(models.Model):
     userID = models.OneToOneField('eShop.CustomUser', on_delete=models.CASCADE)
 
@@ -34,9 +47,14 @@ class ShoppingCartItem(models.Model):
     productID = models.ForeignKey(Product, on_delete=models.DO_NOTHING)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cartID', 'productID'], name='unique_cart_product'),
+        ]
+
     def clean(self):
         # Get the stock level of the product
-        product_stock = self.productID.stock
+        product_stock = self.productID.available_stock
         # Verify that the quantity exceeds the stock level
         if self.quantity > product_stock:
             raise ValidationError(
@@ -45,28 +63,56 @@ class ShoppingCartItem(models.Model):
         if self.quantity < 1:
             raise ValidationError({'quantity': 'Quantity cannot be less than 1.'})
 
-    def save(self, *args, **kwargs):
-        with transaction.atomic():
-            # Checking the adequacy of stock
-            if self.productID.stock < self.quantity:
-                raise ValidationError('The quantity exceeds the available stock.')
-
-            existing_item = ShoppingCartItem.objects.filter(cartID=self.cartID, productID=self.productID).exclude(
-                pk=self.pk).first()
-
-            if existing_item:
-                # If the same item exists, update the quantity of the item and reduce the inventory
-                new_quantity = existing_item.quantity + self.quantity
-
-                if new_quantity > self.productID.stock :
-                    raise ValidationError('The quantity exceeds the available stock after update.')
-                ShoppingCartItem.objects.filter(pk=existing_item.pk).update(quantity=F('quantity') + self.quantity)
-                # Reduction of stockpiles
-                # Reload the productID from the database to get the updated inventory
-                self.productID.refresh_from_db()
-            else:
-                # Reduce inventory and save new shopping cart items
-                super().save(*args, **kwargs)
+    @classmethod
+    def add_to_cart(cls, cart_id, product_id, quantity):
+        """
+        Add `quantity` of a product to a cart: insert the line, or add to the quantity of the existing
+        (cart, product) line. The SELECT only yields a row while the resulting quantity fits in the available
+        stock, so the statement affects no row when it does not, and ValidationError is raised.
+        Concurrent adds to the same cart queue on the cart row (SELECT ... FOR UPDATE, like the checkout), so the
+        SELECT of each one sees the line as the previous one committed it, whatever the isolation level.
+        Relies on the unique (cartID, productID) constraint.
+        """
+        quote = connection.ops.quote_name
+        item_table = quote(cls._meta.db_table)
+        product_table = quote(Product._meta.db_table)
+        cart = quote(cls._meta.get_field('cartID').column)
+        product = quote(cls._meta.get_field('productID').column)
+        quantity_column = quote('quantity')
+
+        if connection.vendor == 'mysql':
+            on_conflict = (f"ON DUPLICATE KEY UPDATE {item_table}.{quantity_column} = "
+                           f"{item_table}.{quantity_column} + VALUES({quantity_column})")
+        else:
+            on_conflict = (f"ON CONFLICT ({cart}, {product}) DO UPDATE SET {quantity_column} = "
+                           f"{item_table}.{quantity_column} + excluded.{quantity_column}")
+        sql = (f"INSERT INTO {item_table} ({cart}, {product}, {quantity_column}) "
+               f"SELECT %s, p.{quote('id')}, %s FROM {product_table} p "
+               f"LEFT JOIN {item_table} i ON i.{cart} = %s AND i.{product} = p.{quote('id')} "
+               f"WHERE p.{quote('id')} = %s "
+               f"AND COALESCE(i.{quantity_column}, 0) + %s <= p.{quote('stock')} - p.{quote('reserved')} "
+               f"{on_conflict}")
+        with transaction.atomic(savepoint=False):
+            list(ShoppingCart.objects.select_for_update().filter(pk=cart_id).values_list('pk'))
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [cart_id, quantity, cart_id, product_id, quantity])
+                added = cursor.rowcount > 0
+        if not added:
+            raise ValidationError('The quantity exceeds the available stock.')
+
+    def set_quantity(self, quantity):
+        """Replace the quantity of this line, in one UPDATE guarded by the product's available stock."""
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            raise ValidationError({'quantity': 'Quantity must be an integer.'})
+        if quantity < 1:
+            raise ValidationError({'quantity': 'Quantity cannot be less than 1.'})
+        in_stock = Product.objects.annotate(available=F('stock') - F('reserved')).filter(
+            pk=self.productID_id, available__gte=quantity)
+        if not ShoppingCartItem.objects.filter(pk=self.pk).filter(Exists(in_stock)).update(quantity=quantity):
+            raise ValidationError('The quantity exceeds the available stock.')
+        self.quantity = quantity
 
 
 class Address(models.Model):
@@ -106,7 +152,7 @@ class Order(models.Model):
     finishTime = models.DateTimeField(blank=True, null=True, verbose_name="Finish Time")
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='unpaid', verbose_name="Status")
     isPaid = models.BooleanField(choices=IS_PAID_CHOICES, default=False, verbose_name="Is Paid")
-
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Update Time")
 
     def __str__(self):
         return f"Order {self.id} - Status: {self.get_status_display()}"
@@ -114,4 +160,93 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        # Shaped to the order filters: by user, by status and by creation date range
+        indexes = [
+            models.Index(fields=['user', 'createTime'], name='order_user_create_idx'),
+            models.Index(fields=['status', 'createTime'], name='order_status_create_idx'),
+            # The lists are ordered by id: a status alone is read in that order without a sort
+            models.Index(fields=['status', 'id'], name='order_status_id_idx'),
+            models.Index(fields=['createTime'], name='order_create_idx'),
+        ]
+
+
+class OrderItem(models.Model):
+    """One line of an order, alongside the Order.item snapshot, so sales can be queried per product."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    # No constraint: sales history keeps the product id after the product is deleted
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='order_items')
+    quantity = models.IntegerField()
+    unit_price = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in order {self.order_id}"
+
+
+class DailyOrderRollup(models.Model):
+    """Orders and their total value per creation day and current status, maintained by backstage.rollups."""
+    date = models.DateField()
+    status = models.CharField(max_length=10, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status'], name='unique_rollup_date_status'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.status}: {self.orders} orders"
 
+
+class DailyProductSales(models.Model):
+    """Units and value of each product sold in paid orders, per order creation day, maintained by backstage.rollups."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='daily_sales')
+    units = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_sales_date_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} product {self.product_id}: {self.units} units"
+
+
+class StockReservation(models.Model):
+    order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Reservation of {self.quantity} x {self.product_id} for order {self.order_id}"
+
+
+class OrderExportJob(models.Model):
+    """A CSV export of the orders matching `filters`, written to settings.EXPORT_ROOT by a Celery task."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='order_exports')
+    filters = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    rows = models.IntegerField(default=0, verbose_name="Rows Written")
+    total = models.IntegerField(blank=True, null=True, verbose_name="Rows To Write")
+    file_name = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    createTime = models.DateTimeField(auto_now_add=True, verbose_name="Create Time")
+    finishTime = models.DateTimeField(blank=True, null=True, verbose_name="Finish Time")
+
+    def __str__(self):
+        return f"Order export {self.id} - Status: {self.get_status_display()}"
@@ -0,0 +1,159 @@
+import hashlib
+import json
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .iterators import iterate_in_batches
+from .models import Order, OrderItem
+from .rollups import record_transitions
+
+
+def order_filter(user_id=None, statuses=None, start_date=None, end_date=None):
+    """
+    The Q shared by the order list filters: user, a list of statuses and a creation date range
+    (YYYY-MM-DD, both bounds required). Raises ValueError on a malformed date.
+    Every combination is served by one of the Order indexes.
+    """
+    queries = Q()
+    if user_id is not None:
+        queries &= Q(user_id=user_id)
+    if statuses:
+        queries &= Q(status__in=statuses)
+    if start_date and end_date:
+        start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
+        end_datetime = datetime.strptime(end_date, "%Y-%m-%d")
+        queries &= Q(createTime__range=(start_datetime, end_datetime))
+    return queries
+
+
+def order_filters_from(data, user_id=None):
+    """The order_filter keyword arguments carried by a request body."""
+    return {
+        'user_id': data.get('user_id', None) if user_id is None else user_id,
+        'statuses': data.get('statuses', []),
+        'start_date': data.get('start_date', None),
+        'end_date': data.get('end_date', None),
+    }
+
+
+def filter_orders(data, user_id=None):
+    """Orders matching the filters of a request body, see order_filter(). Raises ValueError on a malformed date."""
+    return Order.objects.filter(order_filter(**order_filters_from(data, user_id)))
+
+
+# How long an order count is served from the cache before it is counted again
+ORDER_COUNT_TIMEOUT = 60
+
+
+def cached_order_count(filters):
+    """
+    Number of orders matching `filters` (the keyword arguments of order_filter), counted at most once
+    every ORDER_COUNT_TIMEOUT seconds per filter combination. The figure can be that much behind,
+    which is fine for a console total and saves a COUNT(*) on every page view.
+    Raises ValueError on a malformed date.
+    """
+    digest = hashlib.md5(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+    key = f'orders:count:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = Order.objects.filter(order_filter(**filters)).count()
+        cache.set(key, count, ORDER_COUNT_TIMEOUT)
+    return count
+
+
+# Target status -> statuses a paid order may move to it from
+STATUS_TRANSITIONS = {
+    'delivered': ('processing',),
+    'done': ('delivered',),
+}
+
+
+def transition_orders(order_ids, target):
+    """
+    Move the paid orders among `order_ids` whose status allows it to `target`, and return their ids.
+    The change is one compare-and-set UPDATE ... WHERE status IN (allowed) AND isPaid of only the
+    changed columns, so a concurrent change of any other column (e.g. by the payment task) is kept
+    and an order that has moved on meanwhile is simply not transitioned. The rows are locked and read
+    first, in the same transaction, to keep the status rollup in step.
+    """
+    allowed = STATUS_TRANSITIONS[target]
+    with transaction.atomic():
+        matching = Order.objects.filter(pk__in=order_ids, status__in=allowed, isPaid=True)
+        rows = list(matching.select_for_update().values_list('id', 'status', 'createTime', 'totalCost'))
+        if not rows:
+            return []
+        now = timezone.now()
+        changes = {'status': target, 'updated_at': now}
+        if target == 'done':
+            changes['finishTime'] = now
+        matching.filter(pk__in=[row[0] for row in rows]).update(**changes)
+        record_transitions([row[1:] for row in rows], target)
+    return [row[0] for row in rows]
+
+
+def create_order_items(order, items):
+    """Insert the OrderItem rows of a new order from its cart lines (joined with their product) in one query."""
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=item.productID_id, quantity=item.quantity, unit_price=item.productID.price)
+        for item in items
+    ])
+
+
+def _unit_price(line):
+    detail = line.get('product_detail') or {}
+    if detail.get('price') is not None:
+        return float(detail['price'])
+    # Lines without the product snapshot only carry the line total
+    if line.get('final_price') is not None and line.get('quantity'):
+        return float(line['final_price']) / line['quantity']
+    return 0.0
+
+
+def order_items_from_snapshot(order_id, snapshot):
+    """Build (unsaved) OrderItem rows from an Order.item JSON snapshot, skipping malformed lines."""
+    rows = []
+    for line in snapshot or []:
+        if not isinstance(line, dict) or line.get('productID') is None:
+            continue
+        try:
+            rows.append(OrderItem(order_id=order_id, product_id=int(line['productID']),
+                                  quantity=int(line.get('quantity') or 0), unit_price=_unit_price(line)))
+        except (TypeError, ValueError):
+            continue
+    return rows
+
+
+def backfill_order_items(batch_size=1000):
+    """
+    Create the OrderItem rows of orders placed before the table existed, from their Order.item snapshot.
+    Orders are read in primary key batches and every batch is written with one bulk insert in its own
+    transaction; orders that already have rows are skipped, so the backfill can be stopped and run again.
+    Returns a summary {'orders', 'items'}.
+    """
+    summary = {'orders': 0, 'items': 0}
+    batch = []
+
+    def write(batch):
+        done = set(OrderItem.objects.filter(order_id__in=[order['id'] for order in batch])
+                   .values_list('order_id', flat=True).distinct())
+        rows = []
+        for order in batch:
+            if order['id'] not in done:
+                rows.extend(order_items_from_snapshot(order['id'], order['item']))
+                summary['orders'] += 1
+        with transaction.atomic():
+            OrderItem.objects.bulk_create(rows, batch_size=batch_size)
+        summary['items'] += len(rows)
+
+    for order in iterate_in_batches(Order.objects.values('id', 'item'), batch_size):
+        batch.append(order)
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    return summary
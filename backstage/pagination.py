@@ -0,0 +1,28 @@
+from rest_framework import pagination
+
+
+class IdCursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination on the primary key.
+    Every page is read with `WHERE id > <cursor> ORDER BY id LIMIT n`, so deep pages cost the same
+    as the first one and no COUNT(*) is issued.
+    """
+    ordering = 'id'
+
+
+class OrderCursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination of orders, newest first, on (createTime, id).
+    The position is a creation time, so every page is one range read on the createTime indexes.
+    """
+    ordering = ('-createTime', '-id')
+
+
+def get_paginator(request, cursor_class=IdCursorPagination):
+    """
+    Pick the paginator requested by the client.
+    `?pagination=cursor` switches to keyset pagination, anything else keeps the default page-number mode.
+    """
+    if request.query_params.get('pagination') == 'cursor':
+        return cursor_class()
+    return pagination.PageNumberPagination()
@@ -0,0 +1,154 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order
+from .reservations import RESERVATION_TTL, deduct_paid_stock, release_order_reservations
+from .rollups import record_orders_paid, record_transitions
+
+# How long after its creation an unpaid order is still polled for a payment, same as the stock hold
+PAYMENT_WINDOW = RESERVATION_TTL
+PAID_TRADE_STATUSES = ("TRADE_SUCCESS", "TRADE_FINISHED")
+# Trade query answer for an order whose payment page was never opened
+TRADE_NOT_EXIST = "ACQ.TRADE_NOT_EXIST"
+# How far back reconcile_unpaid_orders() looks by default. Older unpaid orders were cancelled by earlier runs,
+# or predate them and need a one-off run over all orders
+RECONCILE_LOOKBACK = timedelta(days=2)
+
+logger = logging.getLogger(__name__)
+
+
+def payment_succeeded(trade):
+    """Whether an api_alipay_trade_query response reports the trade as paid."""
+    return trade.get("trade_status", "") in PAID_TRADE_STATUSES
+
+
+def pending_payments():
+    """Unpaid orders still inside the payment window."""
+    return Order.objects.filter(status='unpaid', isPaid=False, createTime__gte=timezone.now() - PAYMENT_WINDOW)
+
+
+def recent_unpaid_orders():
+    """Unpaid orders created inside RECONCILE_LOOKBACK, the default scope of reconcile_unpaid_orders()."""
+    return Order.objects.filter(status='unpaid', isPaid=False, createTime__gte=timezone.now() - RECONCILE_LOOKBACK)
+
+
+def mark_orders_paid(order_ids):
+    """
+    Flip orders to paid / processing and deduct their stock, exactly once per order.
+    The flip is a conditional UPDATE ... WHERE isPaid = false on the locked rows and the stock is deducted
+    by a single set-based UPDATE in the same transaction, so when the poller, a notification, a rescheduled
+    check or a retry reach the same order, only the first one deducts the stock. Returns the ids this call marked.
+    """
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().filter(pk__in=order_ids, isPaid=False)
+                      .only('id', 'item', 'status', 'createTime', 'totalCost'))
+        if not orders:
+            return []
+        marked = [order.id for order in orders]
+        Order.objects.filter(pk__in=marked, isPaid=False).update(isPaid=True, status='processing',
+                                                                 updated_at=timezone.now())
+        quantities = {}
+        for order in orders:
+            for item in order.item:
+                quantities[item["productID"]] = quantities.get(item["productID"], 0) + item["quantity"]
+        # The sold units leave the stock and their holds are dropped, in one UPDATE for all products
+        short = deduct_paid_stock(marked, quantities)
+        if short:
+            # Paid after the hold expired and the units went to another order, needs restocking or a refund
+            logger.warning("Orders %s were paid for units no longer in stock: %s", marked, short)
+        record_transitions([(order.status, order.createTime, order.totalCost) for order in orders], 'processing')
+        record_orders_paid(marked)
+    return marked
+
+
+def mark_order_paid(order_id):
+    """mark_orders_paid() for one order, returns whether this call marked it."""
+    return bool(mark_orders_paid([order_id]))
+
+
+def cancel_unpaid_orders(order_ids):
+    """Cancel the orders among `order_ids` that are still unpaid, in one conditional UPDATE. Returns their ids."""
+    with transaction.atomic():
+        matching = Order.objects.filter(pk__in=order_ids, status='unpaid', isPaid=False)
+        rows = list(matching.select_for_update().values_list('id', 'status', 'createTime', 'totalCost'))
+        if not rows:
+            return []
+        cancelled = [row[0] for row in rows]
+        matching.filter(pk__in=cancelled).update(status='cancel', updated_at=timezone.now())
+        release_order_reservations(cancelled)
+        record_transitions([row[1:] for row in rows], 'cancel')
+    return cancelled
+
+
+def _query_trade(client, order_id):
+    try:
+        return order_id, client.api_alipay_trade_query(out_trade_no=order_id)
+    except Exception:
+        return order_id, None
+
+
+def reconcile_unpaid_orders(client, workers=8, orders=None):
+    """
+    Ask the gateway about unpaid orders, by default recent_unpaid_orders(), and apply the answers.
+    The trade queries are blocking SDK calls, so up to `workers` of them run at once in a thread pool;
+    the threads only talk to the gateway. The outcome is then applied with one bulk mark-paid and one
+    bulk cancel. Closed trades are cancelled, and so are orders past the payment window that never opened
+    a trade: their payment link has expired, so they would otherwise be queried again on every run.
+    Returns a summary {'checked', 'paid', 'cancelled', 'unknown', 'seconds'}.
+    """
+    if orders is None:
+        orders = recent_unpaid_orders()
+    created = dict(orders.values_list('id', 'createTime'))
+    expired_before = timezone.now() - PAYMENT_WINDOW
+
+    started = time.monotonic()
+    paid, closed, unknown = [], [], 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for order_id, trade in pool.map(lambda pk: _query_trade(client, pk), created):
+            if trade is None:
+                unknown += 1
+            elif payment_succeeded(trade):
+                paid.append(order_id)
+            elif trade.get("trade_status") == "TRADE_CLOSED":
+                closed.append(order_id)
+            elif trade.get("sub_code") == TRADE_NOT_EXIST and created[order_id] < expired_before:
+                closed.append(order_id)
+            else:
+                # Still waiting for the buyer, or no trade opened yet
+                unknown += 1
+
+    marked = mark_orders_paid(paid) if paid else []
+    cancelled = cancel_unpaid_orders(closed) if closed else []
+    return {
+        'checked': len(created),
+        'paid': len(marked),
+        'cancelled': len(cancelled),
+        'unknown': unknown,
+        'seconds': time.monotonic() - started,
+    }
+
+
+def apply_trade_notification(params):
+    """
+    Act on a verified asynchronous trade notification. Only paid trades whose amount matches the order
+    mark it paid; anything else is acknowledged and ignored. Returns whether the notification was valid.
+    """
+    if params.get("app_id") != settings.ALIPAY_APPID:
+        return False
+    try:
+        order_id = int(params.get("out_trade_no"))
+        amount = float(params.get("total_amount"))
+    except (TypeError, ValueError):
+        return False
+    order = Order.objects.filter(pk=order_id).values('totalCost').first()
+    if order is None or round(order['totalCost'], 2) != round(amount, 2):
+        return False
+    if payment_succeeded(params):
+        mark_order_paid(order_id)
+    return True
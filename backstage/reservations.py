@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Case, When, Value, IntegerField
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .caching import bump_product
+from .models import Product, StockReservation
+
+# Same window as the payment status polling
+RESERVATION_TTL = timedelta(minutes=15)
+
+
+def _bump_after_commit(product_ids):
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: [bump_product(pk) for pk in product_ids])
+
+
+def reserve_order_stock(order, quantities):
+    """
+    Hold `quantities` ({product id: units}) for `order` until RESERVATION_TTL has passed.
+    All products are locked with one SELECT ... FOR UPDATE (in id order, so concurrent checkouts cannot
+    deadlock) and checked in memory; the counters are then raised by a single conditional UPDATE that
+    only matches rows where stock - reserved still covers the units.
+    Must run inside the transaction that creates the order; raises ValidationError when a product does
+    not have enough available stock, which rolls the whole order back.
+    """
+    locked = Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+    available = {pk: stock - reserved for pk, stock, reserved in locked.values_list('pk', 'stock', 'reserved')}
+    short = [pk for pk, quantity in quantities.items() if available.get(pk, 0) < quantity]
+    if short:
+        raise ValidationError({'stock': [f'Not enough stock available for product {pk}.' for pk in short]})
+
+    now = timezone.now()
+    held = Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                output_field=IntegerField())
+    updated = Product.objects.filter(pk__in=quantities, stock__gte=F('reserved') + held).update(
+        reserved=F('reserved') + held, updated_at=now)
+    if updated != len(quantities):
+        raise ValidationError({'stock': ['Not enough stock available.']})
+
+    expires_at = now + RESERVATION_TTL
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+    _bump_after_commit(quantities)
+
+
+def _release(reservations):
+    """Delete the given reservations and give their units back, one DELETE and one UPDATE in total."""
+    with transaction.atomic():
+        held = list(reservations.select_for_update().values_list('id', 'product_id', 'quantity'))
+        if not held:
+            return 0
+        totals = {}
+        for _, product_id, quantity in held:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in held]).delete()
+        released = Case(*[When(pk=product_id, then=Value(quantity)) for product_id, quantity in totals.items()],
+                        output_field=IntegerField())
+        Product.objects.filter(pk__in=totals).update(reserved=F('reserved') - released, updated_at=timezone.now())
+        _bump_after_commit(totals)
+    return len(held)
+
+
+def release_order_reservations(order_ids):
+    """Release the holds of orders that were paid (the stock is deducted instead) or cancelled."""
+    return _release(StockReservation.objects.filter(order_id__in=order_ids))
+
+
+def release_expired_reservations():
+    """Sweep every hold whose TTL has passed, returns how many were released."""
+    return _release(StockReservation.objects.filter(expires_at__lte=timezone.now()))
+
+
+def _case(amounts):
+    return Case(*[When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()],
+                default=Value(0), output_field=IntegerField())
+
+
+def deduct_paid_stock(order_ids, quantities):
+    """
+    Deduct `quantities` ({product id: units}) sold by paid orders and drop the holds of those orders.
+    One DELETE of the holds and one UPDATE setting stock = stock - units and reserved = reserved - held
+    for every product at once, so concurrent payments never overwrite each other's decrements.
+    Must run in the transaction that marks the orders paid, which is what makes it happen only once.
+    A payment can still land after its hold was swept and the units sold to someone else; the stock is then
+    only taken down to zero and the missing units are returned as {product id: units} for a follow-up.
+    """
+    held = list(StockReservation.objects.select_for_update().filter(order_id__in=order_ids)
+                .values_list('id', 'product_id', 'quantity'))
+    released = {}
+    for _, product_id, quantity in held:
+        released[product_id] = released.get(product_id, 0) + quantity
+    if held:
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in held]).delete()
+
+    product_ids = set(quantities) | set(released)
+    if not product_ids:
+        return {}
+    stock = dict(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk')
+                 .values_list('pk', 'stock'))
+    deducted = {pk: min(quantity, stock.get(pk, 0)) for pk, quantity in quantities.items()}
+    Product.objects.filter(pk__in=product_ids).update(
+        stock=F('stock') - _case(deducted), reserved=F('reserved') - _case(released), updated_at=timezone.now())
+    _bump_after_commit(product_ids)
+    return {pk: quantity - deducted[pk] for pk, quantity in quantities.items() if quantity > deducted[pk]}
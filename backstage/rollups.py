@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from django.db import transaction, IntegrityError
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, DailyOrderRollup, DailyProductSales
+
+# Statuses of orders that have been paid for and count as revenue
+PAID_STATUSES = ('processing', 'delivered', 'done')
+
+
+def _add(model, keys, **deltas):
+    """Add `deltas` to the counters of the rollup row identified by `keys`, creating the row if needed."""
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**keys).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        # Created meanwhile by a concurrent writer
+        model.objects.filter(**keys).update(**increments)
+
+
+def record_order_created(order):
+    _add(DailyOrderRollup, {'date': timezone.localdate(order.createTime), 'status': order.status},
+         orders=1, revenue=order.totalCost)
+
+
+def record_transitions(orders, new_status):
+    """
+    Move orders from their previous status to `new_status` in the status rollup.
+    `orders` holds (previous status, createTime, totalCost) triples; they are grouped by day and
+    status first, so a bulk transition costs two statements per affected day, not per order.
+    """
+    moves = defaultdict(lambda: [0, 0.0])
+    for previous, created, total in orders:
+        if previous == new_status:
+            continue
+        date = timezone.localdate(created)
+        moves[(date, previous)][0] -= 1
+        moves[(date, previous)][1] -= total
+        moves[(date, new_status)][0] += 1
+        moves[(date, new_status)][1] += total
+    for (date, order_status), (count, revenue) in moves.items():
+        _add(DailyOrderRollup, {'date': date, 'status': order_status}, orders=count, revenue=revenue)
+
+
+def record_status_change(order, previous_status):
+    record_transitions([(previous_status, order.createTime, order.totalCost)], order.status)
+
+
+def _product_sales(items):
+    line_total = ExpressionWrapper(F('quantity') * F('unit_price'), output_field=FloatField())
+    return (items.annotate(date=TruncDate('order__createTime'))
+            .values('date', 'product_id')
+            .annotate(units=Sum('quantity'), revenue=Sum(line_total))
+            .order_by())
+
+
+def record_orders_paid(order_ids):
+    """Add the lines of newly paid orders to the product sales rollup, one grouped read for all of them."""
+    for row in _product_sales(OrderItem.objects.filter(order_id__in=order_ids)):
+        _add(DailyProductSales, {'date': row['date'], 'product_id': row['product_id']},
+             units=row['units'], revenue=row['revenue'])
+
+
+def rebuild_rollups():
+    """Recompute both rollup tables from the orders, with one GROUP BY query each, in one transaction."""
+    with transaction.atomic():
+        DailyOrderRollup.objects.all().delete()
+        DailyProductSales.objects.all().delete()
+        order_rows = (Order.objects.annotate(date=TruncDate('createTime'))
+                      .values('date', 'status')
+                      .annotate(count=Count('id'), revenue=Sum('totalCost'))
+                      .order_by())
+        DailyOrderRollup.objects.bulk_create(
+            DailyOrderRollup(date=row['date'], status=row['status'], orders=row['count'], revenue=row['revenue'] or 0)
+            for row in order_rows)
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(date=row['date'], product_id=row['product_id'], units=row['units'] or 0,
+                              revenue=row['revenue'] or 0)
+            for row in _product_sales(OrderItem.objects.filter(order__isPaid=True)))
+    return DailyOrderRollup.objects.count(), DailyProductSales.objects.count()
+
+
+def sales_dashboard(start, end, top=10):
+    """Daily orders and revenue, orders per status and the best selling products between two dates, from the rollups."""
+    status_rows = DailyOrderRollup.objects.filter(date__range=(start, end))
+    days = defaultdict(lambda: {'orders': 0, 'revenue': 0.0})
+    statuses = defaultdict(int)
+    for row in status_rows.values('date', 'status', 'orders', 'revenue'):
+        day = days[row['date']]
+        day['orders'] += row['orders']
+        if row['status'] in PAID_STATUSES:
+            day['revenue'] += row['revenue']
+        statuses[row['status']] += row['orders']
+
+    products = (DailyProductSales.objects.filter(date__range=(start, end))
+                .values('product_id', 'product__name')
+                .annotate(units=Sum('units'), revenue=Sum('revenue'))
+                .order_by('-units')[:top])
+    return {
+        'days': [{'date': date, **values} for date, values in sorted(days.items())],
+        'statuses': dict(statuses),
+        'top_products': [{'id': row['product_id'], 'name': row['product__name'], 'units': row['units'],
+                          'revenue': row['revenue']} for row in products],
+    }
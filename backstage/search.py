@@ -0,0 +1,359 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count, Q, Sum
+
+from .caching import bump_version, get_version
+from .models import Product, OrderItem
+
+NGRAM_SIZE = 3
+# Above this many matches, filtering a query with id__in costs more than name__icontains: the ids are
+# inlined in the SQL of every query that uses the filter
+MAX_ID_FILTER = 1000
+# Shared cache version of the product indexes, bumped to have every process rebuild its own
+INDEX_VERSION = 'product-index'
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class LazyProductIndex:
+    """
+    Base for the in-process product indexes.
+    The index is built in a background thread on first use and kept up to date by the Product signals
+    of this process; changes that arrive during a build are queued and replayed on the new state before
+    it is swapped in. Other processes (web workers, Celery, management commands) cannot reach it, so
+    the index is also rebuilt every `rebuild_interval` seconds, and in every process when the shared
+    INDEX_VERSION is bumped by invalidate() (e.g. after a bulk import). The shared version lives in the cache,
+    so it is read at most every `version_check_interval` seconds rather than on every query.
+    Subclasses provide the state: _load_state() builds it from the database and _apply_to() applies
+    one (pk, name) change, name None meaning the product was deleted.
+    """
+    rebuild_interval = 10 * 60
+    version_check_interval = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._ready = False
+        self._building = False
+        self._pending = []
+        self._version = None
+        self._built_at = 0
+        self._checked_at = 0
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def warm(self):
+        """Start a background build unless one is already running."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._pending = []
+        threading.Thread(target=self.build, daemon=True).start()
+
+    def build(self):
+        try:
+            self.load()
+        except Exception:
+            with self._lock:
+                self._building = False
+            raise
+        finally:
+            # Background threads get their own connection, do not leak it
+            connection.close()
+
+    def load(self):
+        """Build the index in the calling thread."""
+        with self._lock:
+            self._building = True
+        # Read before loading: a bump during the load triggers another build
+        version = get_version(INDEX_VERSION)
+        state = self._load_state()
+        with self._lock:
+            for pk, name in self._pending:
+                self._apply_to(state, pk, name)
+            self._state = state
+            self._pending = []
+            self._version = version
+            self._built_at = self._checked_at = time.monotonic()
+            self._ready = True
+            self._building = False
+
+    def _fresh(self):
+        """
+        Whether the index can answer now. A cold index, or one built before the last shared invalidation,
+        starts a rebuild and cannot; an index past its rebuild interval starts one but still answers.
+        """
+        if not self._ready:
+            self.warm()
+            return False
+        now = time.monotonic()
+        if now - self._checked_at > self.version_check_interval:
+            self._checked_at = now
+            if self._version != get_version(INDEX_VERSION):
+                self.warm()
+                return False
+        if now - self._built_at > self.rebuild_interval:
+            self.warm()
+        return True
+
+    def invalidate(self):
+        """Drop the index in every process; queries fall back to the ORM until it has been rebuilt."""
+        bump_version(INDEX_VERSION)
+        with self._lock:
+            self._state = None
+            self._ready = False
+
+    def update(self, pk, name):
+        self._apply(pk, name)
+
+    def remove(self, pk):
+        self._apply(pk, None)
+
+    def _apply(self, pk, name):
+        with self._lock:
+            if self._building:
+                self._pending.append((pk, name))
+            if self._ready:
+                self._apply_to(self._state, pk, name)
+
+    def _load_state(self):
+        raise NotImplementedError
+
+    def _apply_to(self, state, pk, name):
+        raise NotImplementedError
+
+
+class ProductNameIndex(LazyProductIndex):
+    """
+    In-process n-gram inverted index over Product.name.
+    Every name is split into overlapping n-grams; a substring query intersects the posting sets of its
+    own n-grams and then confirms the candidates against the stored names, so no table scan is needed.
+    While the index is cold, search() returns None and the caller should fall back to the ORM.
+    """
+
+    def __init__(self, n=NGRAM_SIZE):
+        super().__init__()
+        self.n = n
+
+    def search(self, query):
+        """
+        Return the sorted ids of products whose name contains `query` (case-insensitive),
+        or None when the index cannot answer and the ORM should be used instead.
+        """
+        query = query.casefold()
+        if len(query) < self.n or not self._fresh():
+            return None
+
+        with self._lock:
+            if not self._ready:
+                return None
+            names, postings = self._state
+            postings = [postings.get(gram) for gram in ngrams(query, self.n)]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting
+                if not candidates:
+                    return []
+            # n-grams can match out of order, confirm the real substring
+            return sorted(pk for pk in candidates if query in names[pk])
+
+    def _load_state(self):
+        state = ({}, defaultdict(set))
+        for pk, name in Product.objects.values_list('id', 'name').iterator(chunk_size=5000):
+            self._apply_to(state, pk, name)
+        return state
+
+    def _apply_to(self, state, pk, name):
+        names, postings = state
+        old_name = names.pop(pk, None)
+        if old_name is not None:
+            for gram in ngrams(old_name, self.n):
+                posting = postings.get(gram)
+                if posting is not None:
+                    posting.discard(pk)
+                    if not posting:
+                        del postings[gram]
+        if name is not None:
+            name = name.casefold()
+            names[pk] = name
+            for gram in ngrams(name, self.n):
+                postings[gram].add(pk)
+
+
+class _AutocompleteState:
+    def __init__(self, popularity):
+        # Sorted (folded name, pk) pairs, a prefix is one contiguous slice found by bisection
+        self.keys = []
+        self.names = {}
+        self.popularity = popularity
+        # Top ids of the prefixes whose slice is too long to rank per request, ranked when the index is built
+        self.top = {}
+
+
+class ProductAutocomplete(LazyProductIndex):
+    """
+    Prefix completion of product names from a sorted array, ranked by units sold.
+    A prefix maps to a contiguous slice of the array. Slices of up to `scan_limit` names are ranked on the fly,
+    which keeps a completion well under a millisecond; the rankings of the longer ones are computed when the
+    index is built and kept up to date as names change. The whole index, popularity included, is rebuilt in
+    the background every `rebuild_interval` seconds. See the bench_autocomplete command for the latency.
+    """
+    max_limit = 20
+    scan_limit = 250
+    rebuild_interval = 60 * 60
+
+    def complete(self, prefix, limit=10):
+        """Return up to `limit` (id, name) pairs starting with `prefix`, or None while the index is cold."""
+        if not self._fresh():
+            return None
+
+        prefix = prefix.casefold()
+        limit = min(limit, self.max_limit)
+        if not prefix:
+            return []
+        with self._lock:
+            if not self._ready:
+                return None
+            state = self._state
+            lo, hi = self._slice(state, prefix)
+            if hi - lo <= self.scan_limit:
+                ranked = self._rank(state, lo, hi, limit)
+            else:
+                ranked = state.top.get(prefix)
+                if ranked is None:
+                    ranked = state.top[prefix] = self._rank(state, lo, hi, self.max_limit)
+            return [(pk, state.names[pk][0]) for pk in ranked[:limit]]
+
+    @staticmethod
+    def _slice(state, prefix):
+        lo = bisect.bisect_left(state.keys, (prefix,))
+        hi = bisect.bisect_left(state.keys, (prefix[:-1] + chr(ord(prefix[-1]) + 1),))
+        return lo, hi
+
+    @staticmethod
+    def _rank_key(state, key):
+        return -state.popularity.get(key[1], 0), key[0]
+
+    def _rank(self, state, lo, hi, limit):
+        best = heapq.nsmallest(limit, state.keys[lo:hi], key=lambda key: self._rank_key(state, key))
+        return [pk for _, pk in best]
+
+    def _rank_long_prefixes(self, state, prefix='', lo=0, hi=None):
+        """Rank every prefix whose slice is longer than scan_limit, walking down from `prefix`."""
+        if hi is None:
+            hi = len(state.keys)
+        if prefix:
+            state.top[prefix] = self._rank(state, lo, hi, self.max_limit)
+        while lo < hi:
+            folded = state.keys[lo][0]
+            if len(folded) <= len(prefix):
+                lo += 1
+                continue
+            child = folded[:len(prefix) + 1]
+            child_lo, child_hi = self._slice(state, child)
+            if child_hi - child_lo > self.scan_limit:
+                self._rank_long_prefixes(state, child, child_lo, child_hi)
+            lo = child_hi
+
+    def _load_state(self):
+        # Units sold per product, one GROUP BY over the OrderItem product index
+        popularity = dict(OrderItem.objects.values_list('product_id').annotate(units=Sum('quantity')).order_by())
+        state = _AutocompleteState(popularity)
+        for pk, name in Product.objects.values_list('id', 'name').iterator(chunk_size=5000):
+            state.names[pk] = (name, name.casefold())
+            state.keys.append((name.casefold(), pk))
+        state.keys.sort()
+        self._rank_long_prefixes(state)
+        return state
+
+    def _apply_to(self, state, pk, name):
+        old = state.names.pop(pk, None)
+        if old is not None:
+            key = (old[1], pk)
+            i = bisect.bisect_left(state.keys, key)
+            if i < len(state.keys) and state.keys[i] == key:
+                del state.keys[i]
+            self._remove_from_rankings(state, old[1], pk)
+        if name is not None:
+            folded = name.casefold()
+            state.names[pk] = (name, folded)
+            bisect.insort(state.keys, (folded, pk))
+            self._add_to_rankings(state, folded, pk)
+
+    def _add_to_rankings(self, state, folded, pk):
+        for i in range(1, len(folded) + 1):
+            ranked = state.top.get(folded[:i])
+            if ranked is None:
+                continue
+            ranked.append(pk)
+            ranked.sort(key=lambda other: self._rank_key(state, (state.names[other][1], other)))
+            del ranked[self.max_limit:]
+
+    def _remove_from_rankings(self, state, folded, pk):
+        for i in range(1, len(folded) + 1):
+            ranked = state.top.get(folded[:i])
+            if ranked is not None and pk in ranked:
+                # One of the top names went away, rank the prefix again on its next use
+                del state.top[folded[:i]]
+
+
+product_name_index = ProductNameIndex()
+product_autocomplete = ProductAutocomplete()
+# Every index that has to follow product name changes
+product_indexes = (product_name_index, product_autocomplete)
+
+
+# Lower bounds of the price histogram buckets, the last bucket is open ended
+PRICE_BUCKETS = (0, 5, 10, 20, 50, 100)
+
+
+def _price_bucket_filters():
+    bounds = list(PRICE_BUCKETS) + [None]
+    for low, high in zip(bounds, bounds[1:]):
+        label = f'{low}-{high}' if high is not None else f'{low}+'
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        yield label, condition
+
+
+def product_facets(products, categories=None, price_filter=None):
+    """
+    Category counts and a price histogram for `products`, computed in one GROUP BY query.
+    Each facet ignores its own filter and honours the other one: category counts apply the price
+    range, the price histogram applies the selected categories. Both come out of the same per-category
+    rows, so the query is run once.
+    """
+    buckets = list(_price_bucket_filters())
+    aggregates = {'matching': Count('id', filter=price_filter)}
+    for i, (_, condition) in enumerate(buckets):
+        aggregates[f'bucket_{i}'] = Count('id', filter=condition)
+    rows = products.values('categoryID', 'categoryID__name').annotate(**aggregates).order_by()
+
+    category_counts = []
+    histogram = [0] * len(buckets)
+    for row in rows:
+        if row['matching']:
+            category_counts.append({'id': row['categoryID'], 'name': row['categoryID__name'], 'count': row['matching']})
+        if not categories or row['categoryID'] in categories:
+            for i in range(len(buckets)):
+                histogram[i] += row[f'bucket_{i}']
+
+    category_counts.sort(key=lambda facet: facet['count'], reverse=True)
+    return {
+        'categories': category_counts,
+        'price': [{'range': label, 'count': count} for (label, _), count in zip(buckets, histogram)],
+    }
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import productCategory, Product, ShoppingCartItem, Address, Order
+from .models import productCategory, Product, ShoppingCartItem, Address, Order, OrderExportJob
 
 
 class ProductCategorySerializer(serializers.ModelSerializer):
@@ -10,16 +10,26 @@ class ProductCategorySerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.SerializerMethodField()
+    available_stock = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Product
         fields = '__all__'
+        read_only_fields = ['reserved']
 
     def get_category_name(self, obj):
         if obj.categoryID:
             return obj.categoryID.name
         return None
 
+    def update(self, instance, validated_data):
+        # Only the supplied columns: a full-row save would write back the `reserved` counter as it was read,
+        # undoing the holds taken meanwhile by backstage.reservations
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
 class ProductSerializerCart(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -32,6 +42,13 @@ class ShoppingCartItemSerializer(serializers.ModelSerializer):
         model = ShoppingCartItem
         fields = ['id', 'cartID', 'productID', 'quantity', 'product_detail']
 
+class ShoppingCartItemDetailSerializer(ShoppingCartItemSerializer):
+    # Annotated by the query as quantity * product price
+    final_price = serializers.FloatField(read_only=True)
+
+    class Meta(ShoppingCartItemSerializer.Meta):
+        fields = ShoppingCartItemSerializer.Meta.fields + ['final_price']
+
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = Address
@@ -52,4 +69,11 @@ class SimpleUserOrderSerializer(serializers.ModelSerializer):
 class SimpleManagerOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['id', 'user', 'createTime', 'totalCost', 'status', 'isPaid']
\ No newline at end of file
+        fields = ['id', 'user', 'createTime', 'totalCost', 'status', 'isPaid']
+
+
+class OrderExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderExportJob
+        fields = ['id', 'user', 'filters', 'status', 'rows', 'total', 'error', 'createTime', 'finishTime']
+        read_only_fields = fields
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .caching import bump_product, bump_category
+from .models import productCategory, Product
+from .search import product_indexes
+
+# Cache versions are bumped on commit, otherwise a concurrent reader could cache the old row under
+# the new version. The pk is copied first because Django clears it on the instance after a delete.
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    pk, name = instance.pk, instance.name
+    transaction.on_commit(lambda: _product_changed(pk, name))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: _product_changed(pk, None))
+
+
+def _product_changed(pk, name):
+    # Indexes too only learn about committed changes, a rolled back save leaves no entry behind
+    for index in product_indexes:
+        if name is None:
+            index.remove(pk)
+        else:
+            index.update(pk, name)
+    bump_product(pk)
+
+
+@receiver(post_save, sender=productCategory)
+@receiver(post_delete, sender=productCategory)
+def category_changed(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: bump_category(pk))
@@ -1,69 +1,72 @@
-import json
+from datetime import timedelta
 
 from celery import shared_task
-from alipay import AliPay
-import time,os
+from django.utils import timezone
 
-from django.db.models import F
+from backstage.alipay_client import get_alipay_client
+from backstage.cart import get_cart_store
+from backstage.exports import run_order_export
+from backstage.models import Order
+from backstage.payments import PAYMENT_WINDOW, mark_order_paid, payment_succeeded, pending_payments, \
+    reconcile_unpaid_orders
+from backstage.reservations import release_expired_reservations
 
-from backstage.models import Order, Product
-# Get the absolute path to the current working directory
-current_working_directory = os.getcwd()
 
-# Absolute path to build to a specific file
-app_private_key_path = os.path.join(current_working_directory, 'backstage', 'PrivateKey.txt')
-alipay_public_key_path = os.path.join(current_working_directory, 'backstage', 'alipayPublicCert.txt')
+def _poll_delay(attempt):
+    """Seconds before the next check of a payment: 5, 10, 20, 40, then every 60."""
+    return min(5 * 2 ** attempt, 60)
 
-# Open and read files securely using the with statement
-with open(app_private_key_path, 'r') as file:
-     app_private_key_string = file.read()
 
-with open(alipay_public_key_path, 'r') as file:
-    alipay_public_key_string = file.read()
+@shared_task(bind=True)
+def query_order_status(self, order_id, attempt=0):
+    """
+    Check the payment of one order once. While it is still unpaid and inside the payment window the
+    check is rescheduled with a growing countdown, so no worker waits between checks; the
+    poll_pending_payments beat task covers orders whose chain of checks was lost.
+    """
+    order = Order.objects.filter(id=order_id).first()
+    if order is None or order.isPaid or order.status != 'unpaid':
+        return
+    response = get_alipay_client().api_alipay_trade_query(out_trade_no=order_id)
+    if payment_succeeded(response):
+        mark_order_paid(order_id)
+        return
+    delay = _poll_delay(attempt)
+    if timezone.now() + timedelta(seconds=delay) < order.createTime + PAYMENT_WINDOW:
+        self.apply_async(args=(order_id, attempt + 1), countdown=delay)
 
 
 @shared_task
-def query_order_status(order_id):
-    alipay = AliPay(
-        appid="9021000129661967",
-        app_notify_url=None,
-        app_private_key_string=app_private_key_string,
-        alipay_public_key_string=alipay_public_key_string,
-        sign_type="RSA2",
-        debug=True
-    )
-    flag = False
-    order = Order.objects.get(id=order_id)
-    for _ in range(180):
-        response = alipay.api_alipay_trade_query(out_trade_no=order_id)
-        if response.get("trade_status", "") in ["TRADE_SUCCESS", "TRADE_FINISHED"]:
-            print("Payment successful")
-            try:
-                order.isPaid = True
-                data = order.item
-                print(f"Order{order_id}:The payment status has been updated to Paid。")
-                flag = True
-                if flag:
-                    order.status = "processing"
-                    for item in data:
-                        product_id = item["productID"]
-                        quantity = item["quantity"]
-
-                        try:
-                            product = Product.objects.get(pk=product_id)
-                            product.stock -= quantity
-                            product.save()
-                            print(f"Updated stock for Product ID {product_id}. New stock is {product.stock}.")
-                        except Product.DoesNotExist:
-                            print(f"Product with ID {product_id} does not exist.")
-
-                else:
-                    order.status = "cancel"
-                order.save()
-                break
-            except Order.DoesNotExist:
-                break
-        time.sleep(5)
+def poll_pending_payments(workers=8):
+    """
+    Check every unpaid order inside the payment window with concurrent trade queries, returns how many
+    were paid. Orders the gateway could not answer for are checked again on the next pass.
+    """
+    return reconcile_unpaid_orders(get_alipay_client(), workers, orders=pending_payments())['paid']
 
 
+@shared_task
+def reconcile_payments(workers=8):
+    """Check the recent unpaid orders against the gateway concurrently and apply the results in bulk."""
+    return reconcile_unpaid_orders(get_alipay_client(), workers)
+
+
+@shared_task
+def flush_dirty_carts():
+    """Write carts changed in Redis back to ShoppingCartItem (redis cart backend only)."""
+    store = get_cart_store()
+    if hasattr(store, 'flush_dirty'):
+        return store.flush_dirty()
+    return 0
+
 
+@shared_task
+def sweep_expired_reservations():
+    """Give back the units held by orders that were not paid in time."""
+    return release_expired_reservations()
+
+
+@shared_task
+def export_orders(job_id):
+    """Write an order export job's CSV file."""
+    return run_order_export(job_id)
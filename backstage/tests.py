@@ -0,0 +1,560 @@
+import io
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
+
+from Cryptodome.PublicKey import RSA
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401, scripting support of fakeredis
+except ImportError:
+    fakeredis = None
+
+from eShop.models import CustomUser
+from . import alipay_client
+from .alipay_client import trust_gateway_key
+from .cart import RedisCartStore
+from .caching import bump_version, get_version
+from .importing import import_products, read_rows
+from .management.commands.fake_alipay_notify import sign_notification
+from .models import productCategory, Product, ShoppingCart, ShoppingCartItem, Address, Order, OrderItem, \
+    DailyOrderRollup, StockReservation
+from .payments import PAYMENT_WINDOW, RECONCILE_LOOKBACK, mark_order_paid, reconcile_unpaid_orders
+from .reservations import release_expired_reservations
+from .search import INDEX_VERSION, ProductAutocomplete, ProductNameIndex, product_name_index
+from .tasks import poll_pending_payments
+
+
+def make_customer(n):
+    user = CustomUser.objects.create_user(email=f'customer{n}@example.com', username=f'customer{n}', password='pw')
+    cart, _ = ShoppingCart.objects.get_or_create(userID=user)
+    address = Address.objects.create(user=user, house_number_and_street='1 High Street', town='Glasgow',
+                                     postcode='G1 1AA')
+    return user, cart, address
+
+
+def run_concurrently(calls):
+    """Run the callables in threads released together, return their results in order."""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(i, call):
+        try:
+            barrier.wait()
+            results[i] = call()
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@skipUnless(connection.vendor in ('mysql', 'sqlite'), "check_query_plans reads MySQL and SQLite plans only")
+class QueryPlanTests(TransactionTestCase):
+    # Transactional: ANALYZE TABLE commits implicitly on MySQL
+    def setUp(self):
+        # On near-empty tables the optimizer may prefer a scan, so seed a few thousand rows spread like production:
+        # many customers, mostly finished orders, two years of dates, and refresh the table statistics
+        customers = [make_customer(n)[:2] for n in range(20)]
+        products = [Product.objects.create(name=f'Product {n}', price=1, stock=100) for n in range(100)]
+        statuses = ['done'] * 16 + ['unpaid', 'cancel', 'processing', 'delivered']
+        Order.objects.bulk_create([Order(user=customers[n % len(customers)][0], totalCost=1,
+                                         status=statuses[n // len(customers) % len(statuses)]) for n in range(4800)])
+        order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+        for month in range(24):
+            Order.objects.filter(pk__in=order_ids[month::24]).update(
+                createTime=timezone.make_aware(datetime(2023 + month // 12, month % 12 + 1, 15)))
+        OrderItem.objects.bulk_create([OrderItem(order_id=order_id, product=products[n % len(products)], quantity=1,
+                                                 unit_price=1) for n, order_id in enumerate(order_ids)])
+        ShoppingCartItem.objects.bulk_create([ShoppingCartItem(cartID=cart, productID=product)
+                                              for _, cart in customers for product in products[:50]])
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                tables = (Order._meta.db_table, OrderItem._meta.db_table, ShoppingCartItem._meta.db_table)
+                cursor.execute(f"ANALYZE TABLE {', '.join(map(connection.ops.quote_name, tables))}")
+            else:
+                cursor.execute("ANALYZE")
+
+    def test_order_filters_use_an_index(self):
+        # Raises CommandError when one of the filter querysets falls back to a full scan
+        call_command('check_query_plans', stdout=io.StringIO())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CheckoutConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.category = productCategory.objects.create(name='Fruit')
+        self.product = Product.objects.create(name='Apple', categoryID=self.category, price=1.5, stock=5)
+
+    def checkout(self, user, address):
+        def call():
+            client = APIClient()
+            client.force_authenticate(user)
+            return client.post(reverse('order-create', args=[user.id]), {'address_id': address.id}, format='json')
+        return call
+
+    def test_double_submit_creates_one_order(self):
+        user, cart, address = make_customer(0)
+        ShoppingCartItem.objects.bulk_create([ShoppingCartItem(cartID=cart, productID=self.product, quantity=2)])
+
+        responses = run_concurrently([self.checkout(user, address), self.checkout(user, address)])
+
+        self.assertEqual(sorted(response.status_code for response in responses), [201, 400])
+        self.assertEqual(Order.objects.filter(user=user).count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 2)
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        customers = [make_customer(n) for n in range(12)]
+        ShoppingCartItem.objects.bulk_create([
+            ShoppingCartItem(cartID=cart, productID=self.product, quantity=1) for _, cart, _ in customers])
+
+        responses = run_concurrently([self.checkout(user, address) for user, _, address in customers])
+
+        self.assertEqual(sum(response.status_code == 201 for response in responses), 5)
+        self.assertEqual(Order.objects.count(), 5)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 5)
+
+
+class CartItemTests(TestCase):
+    def setUp(self):
+        category = productCategory.objects.create(name='Fruit')
+        self.product = Product.objects.create(name='Apple', categoryID=category, price=1.5, stock=5)
+        _, self.cart, _ = make_customer(0)
+
+    def test_save_inserts_the_row(self):
+        item = ShoppingCartItem(cartID=self.cart, productID=self.product, quantity=2)
+        item.save()
+        self.assertIsNotNone(item.pk)
+        self.assertEqual(ShoppingCartItem.objects.get(pk=item.pk).quantity, 2)
+
+    def test_add_to_cart_is_the_cart_lock_and_one_statement(self):
+        with self.assertNumQueries(2):
+            ShoppingCartItem.add_to_cart(self.cart.id, self.product.id, 2)
+        with self.assertNumQueries(2):
+            ShoppingCartItem.add_to_cart(self.cart.id, self.product.id, 2)
+        self.assertEqual(ShoppingCartItem.objects.get(cartID=self.cart).quantity, 4)
+        with self.assertRaises(ValidationError):
+            ShoppingCartItem.add_to_cart(self.cart.id, self.product.id, 2)
+
+    def test_quantity_updates_below_one_are_refused(self):
+        item = ShoppingCartItem.objects.create(cartID=self.cart, productID=self.product, quantity=2)
+        client = APIClient()
+        client.force_authenticate(self.cart.userID)
+        for quantity in (-4, 0, 'two'):
+            response = client.put(reverse('shopping-cart-item-by-product-detail', args=[item.pk]), {'quantity': quantity},
+                                  format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(ShoppingCartItem.objects.get(pk=item.pk).quantity, 2)
+
+    def test_cart_read_is_one_query_whatever_the_number_of_lines(self):
+        client = APIClient()
+        client.force_authenticate(self.cart.userID)
+        products = Product.objects.bulk_create([
+            Product(name=f'Pear {n}', categoryID=self.product.categoryID, price=n + 1, stock=5) for n in range(8)])
+        for count in (1, 8):
+            ShoppingCartItem.objects.all().delete()
+            ShoppingCartItem.objects.bulk_create([
+                ShoppingCartItem(cartID=self.cart, productID=product, quantity=2) for product in products[:count]])
+            with self.assertNumQueries(1):
+                response = client.get(reverse('shopping-cart-item-list-create', args=[self.cart.id]))
+            self.assertEqual(len(response.data['items']), count)
+        self.assertEqual(response.data['total_final_price'], 2 * sum(range(1, 9)))
+
+
+@skipUnless(fakeredis, "fakeredis with lupa is not installed")
+class RedisCartStoreTests(TestCase):
+    def setUp(self):
+        category = productCategory.objects.create(name='Fruit')
+        self.apple = Product.objects.create(name='Apple', categoryID=category, price=1.5, stock=5)
+        self.pear = Product.objects.create(name='Pear', categoryID=category, price=2, stock=5)
+        _, self.cart, _ = make_customer(0)
+        self.store = RedisCartStore(fakeredis.FakeRedis())
+
+    def quantities(self):
+        return dict(ShoppingCartItem.objects.filter(cartID=self.cart).values_list('productID_id', 'quantity'))
+
+    def test_changes_reach_the_rows_on_flush(self):
+        ShoppingCartItem.objects.create(cartID=self.cart, productID=self.pear, quantity=1)
+        self.store.add(self.cart.id, self.apple.id, 2)
+        self.store.add(self.cart.id, self.apple.id, 1)
+        self.store.add(self.cart.id, self.pear.id, 1)
+        # Nothing is written until the cart is flushed
+        self.assertEqual(self.quantities(), {self.pear.id: 1})
+
+        self.assertTrue(self.store.flush(self.cart.id))
+        self.assertEqual(self.quantities(), {self.apple.id: 3, self.pear.id: 2})
+        self.assertFalse(self.store.flush(self.cart.id))
+
+        self.store.remove(ShoppingCartItem.objects.get(cartID=self.cart, productID=self.pear))
+        self.store.set(ShoppingCartItem.objects.get(cartID=self.cart, productID=self.apple), 1)
+        self.assertEqual(self.store.flush_dirty(), 1)
+        self.assertEqual(self.quantities(), {self.apple.id: 1})
+
+    def test_adds_are_checked_against_the_stock(self):
+        self.store.add(self.cart.id, self.apple.id, 4)
+        with self.assertRaises(ValidationError):
+            self.store.add(self.cart.id, self.apple.id, 2)
+        self.store.flush(self.cart.id)
+        self.assertEqual(self.quantities(), {self.apple.id: 4})
+
+    def test_adds_to_a_loaded_cart_do_not_query_the_database(self):
+        self.store.add(self.cart.id, self.apple.id, 1)
+        with self.assertNumQueries(0):
+            self.store.add(self.cart.id, self.apple.id, 1)
+            with self.assertRaises(ValidationError):
+                self.store.add(self.cart.id, self.apple.id, 4)
+        # The product's availability is read again once its Redis entry has expired
+        Product.objects.filter(pk=self.apple.pk).update(stock=2)
+        self.store.client.delete(self.store._availability_key(self.apple.id))
+        with self.assertRaises(ValidationError):
+            self.store.add(self.cart.id, self.apple.id, 1)
+        self.store.add(self.cart.id, self.pear.id, 1)
+        self.store.flush(self.cart.id)
+        self.assertEqual(self.quantities(), {self.apple.id: 2, self.pear.id: 1})
+
+    def test_a_cleared_cart_is_not_written_back(self):
+        self.store.add(self.cart.id, self.apple.id, 1)
+        self.store.clear(self.cart.id)
+        self.assertFalse(self.store.flush(self.cart.id))
+        self.assertEqual(self.quantities(), {})
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CartItemConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        category = productCategory.objects.create(name='Fruit')
+        self.product = Product.objects.create(name='Apple', categoryID=category, price=1.5, stock=5)
+        _, self.cart, _ = make_customer(0)
+
+    def add(self):
+        try:
+            ShoppingCartItem.add_to_cart(self.cart.id, self.product.id, 1)
+            return True
+        except ValidationError:
+            return False
+
+    def test_concurrent_adds_make_one_line_within_the_stock(self):
+        results = run_concurrently([self.add for _ in range(8)])
+
+        self.assertEqual(results.count(True), 5)
+        lines = list(ShoppingCartItem.objects.filter(cartID=self.cart))
+        self.assertEqual([line.quantity for line in lines], [5])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class OrderCancelConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        category = productCategory.objects.create(name='Fruit')
+        product = Product.objects.create(name='Apple', categoryID=category, price=1.5, stock=20)
+        self.user, cart, address = make_customer(0)
+        ShoppingCartItem.objects.bulk_create([ShoppingCartItem(cartID=cart, productID=product, quantity=2)])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('order-create', args=[self.user.id]), {'address_id': address.id},
+                         format='json')
+        self.order = Order.objects.get(user=self.user)
+
+    def cancel(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.put(reverse('user-order-detail', args=[self.user.id, self.order.id]))
+
+    def test_cancel_racing_a_payment_keeps_the_payment_and_the_rollup(self):
+        for _ in range(5):
+            Order.objects.filter(pk=self.order.pk).update(status='unpaid', isPaid=False)
+            DailyOrderRollup.objects.all().delete()
+            DailyOrderRollup.objects.create(date=timezone.localdate(self.order.createTime), status='unpaid', orders=1,
+                                            revenue=self.order.totalCost)
+
+            run_concurrently([self.cancel, lambda: mark_order_paid(self.order.id)])
+
+            order = Order.objects.get(pk=self.order.pk)
+            self.assertTrue(order.isPaid)
+            counts = {row.status: row.orders for row in DailyOrderRollup.objects.all() if row.orders}
+            self.assertEqual(counts, {order.status: 1})
+
+
+class PaymentTests(TestCase):
+    def setUp(self):
+        category = productCategory.objects.create(name='Fruit')
+        self.product = Product.objects.create(name='Apple', categoryID=category, price=1.5, stock=2)
+        self.user, cart, address = make_customer(0)
+        ShoppingCartItem.objects.bulk_create([ShoppingCartItem(cartID=cart, productID=self.product, quantity=2)])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('order-create', args=[self.user.id]), {'address_id': address.id}, format='json')
+        self.order = Order.objects.get(user=self.user)
+
+    def test_payment_link_expires_with_the_stock_hold(self):
+        with mock.patch('backstage.views.get_alipay_client') as client, \
+                mock.patch('backstage.views.query_order_status'):
+            client.return_value.api_alipay_trade_page_pay.return_value = 'signed'
+            response = self.client.get(reverse('alipay', args=[self.user.id, self.order.id]))
+        self.assertEqual(response.status_code, 200)
+        expires_at = (self.order.createTime + PAYMENT_WINDOW).astimezone(ZoneInfo('Asia/Shanghai'))
+        self.assertEqual(client.return_value.api_alipay_trade_page_pay.call_args.kwargs['time_expire'],
+                         expires_at.strftime('%Y-%m-%d %H:%M:%S'))
+
+        Order.objects.filter(pk=self.order.pk).update(createTime=timezone.now() - PAYMENT_WINDOW)
+        response = self.client.get(reverse('alipay', args=[self.user.id, self.order.id]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_notifications_with_a_bad_signature_are_refused(self):
+        for params in ({'out_trade_no': self.order.id, 'sign_type': 'RSA', 'sign': 'c2lnbg=='},
+                       {'out_trade_no': self.order.id, 'sign_type': 'RSA2', 'sign': 'not base64!'},
+                       {'out_trade_no': self.order.id}):
+            response = APIClient().post(reverse('alipay-notify'), params)
+            self.assertEqual((response.status_code, response.content), (400, b'failure'))
+        self.assertFalse(Order.objects.get(pk=self.order.pk).isPaid)
+
+    def test_paid_notification_is_applied_once(self):
+        gateway_key = RSA.generate(2048)
+        params = {'app_id': settings.ALIPAY_APPID, 'out_trade_no': str(self.order.id),
+                  'total_amount': f'{self.order.totalCost:.2f}', 'trade_no': 'T1', 'trade_status': 'TRADE_SUCCESS'}
+        params['sign'] = sign_notification(params, gateway_key)
+        params['sign_type'] = 'RSA2'
+
+        with mock.patch.object(alipay_client, '_client', None):
+            trust_gateway_key(gateway_key.publickey().export_key().decode())
+            for _ in range(2):
+                response = APIClient().post(reverse('alipay-notify'), params)
+                self.assertEqual((response.status_code, response.content), (200, b'success'))
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.isPaid, order.status), (True, 'processing'))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (0, 0))
+        self.assertEqual(DailyOrderRollup.objects.get(status='processing').orders, 1)
+
+    def test_late_payment_does_not_drive_stock_negative(self):
+        # The hold was swept and one of the units sold to another order before the payment landed
+        StockReservation.objects.update(expires_at=timezone.now())
+        release_expired_reservations()
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+
+        with self.assertLogs('backstage.payments', 'WARNING') as logs:
+            self.assertTrue(mark_order_paid(self.order.id))
+        self.assertIn(f'{self.product.pk}: 1', logs.output[0])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (0, 0))
+
+
+class TradeGateway:
+    """Answers trade queries from a dict {order id: trade}, orders it does not know never opened a trade."""
+
+    def __init__(self, trades):
+        self.trades = trades
+        self.queried = []
+
+    def api_alipay_trade_query(self, out_trade_no):
+        self.queried.append(out_trade_no)
+        return self.trades.get(out_trade_no, {"code": "40004", "sub_code": "ACQ.TRADE_NOT_EXIST"})
+
+
+class PaymentReconcileTests(TestCase):
+    def setUp(self):
+        category = productCategory.objects.create(name='Fruit')
+        self.product = Product.objects.create(name='Apple', categoryID=category, price=1.5, stock=10)
+        self.user, _, _ = make_customer(0)
+
+    def order(self, age):
+        order = Order.objects.create(user=self.user, totalCost=1.5,
+                                     item=[{'productID': self.product.id, 'quantity': 1}])
+        Order.objects.filter(pk=order.pk).update(createTime=timezone.now() - age)
+        return order.id
+
+    def test_beat_poller_checks_the_orders_inside_the_payment_window(self):
+        paid, waiting, expired = self.order(timedelta(minutes=1)), self.order(timedelta(minutes=2)), \
+            self.order(PAYMENT_WINDOW + timedelta(minutes=1))
+        gateway = TradeGateway({paid: {"trade_status": "TRADE_SUCCESS"}, waiting: {"trade_status": "WAIT_BUYER_PAY"}})
+
+        with mock.patch('backstage.tasks.get_alipay_client', return_value=gateway):
+            self.assertEqual(poll_pending_payments(), 1)
+        self.assertEqual(sorted(gateway.queried), [paid, waiting])
+        self.assertEqual(Order.objects.get(pk=paid).status, 'processing')
+        self.assertEqual(Order.objects.get(pk=expired).status, 'unpaid')
+
+    def test_reconcile_cancels_expired_orders_without_a_trade(self):
+        fresh, expired, ancient = self.order(timedelta(minutes=1)), \
+            self.order(PAYMENT_WINDOW + timedelta(minutes=1)), self.order(RECONCILE_LOOKBACK + timedelta(hours=1))
+        gateway = TradeGateway({})
+
+        summary = reconcile_unpaid_orders(gateway)
+        self.assertEqual((summary['checked'], summary['cancelled'], summary['unknown']), (2, 1, 1))
+        self.assertEqual(sorted(gateway.queried), [fresh, expired])
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        self.assertEqual((statuses[fresh], statuses[expired], statuses[ancient]), ('unpaid', 'cancel', 'unpaid'))
+
+        # The expired order is settled, the next run does not ask about it again
+        gateway.queried = []
+        reconcile_unpaid_orders(gateway)
+        self.assertEqual(gateway.queried, [fresh])
+
+
+class ProductListTests(TestCase):
+    def setUp(self):
+        self.user, _, _ = make_customer(0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = productCategory.objects.create(name='Fruit')
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(3):
+                Product.objects.create(name=f'Apple {n}', categoryID=category, price=1.5, stock=5)
+        self.category = category
+
+    def test_cursor_pages_do_not_count_the_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'), {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+
+    def test_product_update_keeps_the_holds_taken_meanwhile(self):
+        product = Product.objects.get(name='Apple 0')
+        # The view has read the product when a checkout holds 3 units, as reserve_order_stock does
+        with mock.patch('backstage.views.ProductDetailView.get_object', return_value=product):
+            Product.objects.filter(pk=product.pk).update(reserved=F('reserved') + 3)
+            response = self.client.put(reverse('product-detail', args=[product.pk]),
+                                       {'name': 'Apple 0', 'categoryID': self.category.pk, 'price': 2, 'stock': 8},
+                                       format='json')
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual((product.price, product.stock, product.reserved), (2, 8, 3))
+
+    def test_etag_follows_product_writes(self):
+        etag = self.client.get(reverse('product-list'))['ETag']
+        self.assertEqual(self.client.get(reverse('product-list'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Pear', categoryID=self.category, price=2, stock=1)
+        self.assertEqual(self.client.get(reverse('product-list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ProductNameIndexTests(TestCase):
+    def setUp(self):
+        self.category = productCategory.objects.create(name='Fruit')
+        Product.objects.create(name='Green Apple', categoryID=self.category, price=1, stock=1)
+        # Build in the test thread, background builds would not see the test transaction
+        patcher = mock.patch.object(ProductNameIndex, 'warm')
+        self.warm = patcher.start()
+        self.addCleanup(patcher.stop)
+        product_name_index.load()
+
+    def test_finds_substrings(self):
+        self.assertEqual(len(product_name_index.search('apple')), 1)
+        self.assertEqual(product_name_index.search('pear'), [])
+
+    def test_only_committed_changes_reach_the_index(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Product.objects.create(name='Red Apple', categoryID=self.category, price=1, stock=1)
+                raise RuntimeError
+        self.assertEqual(len(product_name_index.search('apple')), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Red Apple', categoryID=self.category, price=1, stock=1)
+        self.assertEqual(len(product_name_index.search('apple')), 2)
+
+    def test_shared_invalidation_rebuilds_every_process(self):
+        # Another process changed the catalog in bulk and bumped the shared version
+        bump_version(INDEX_VERSION)
+        # Seen once the shared version is due for a check, not on every query
+        self.assertEqual(len(product_name_index.search('apple')), 1)
+        with mock.patch('backstage.search.time.monotonic',
+                        return_value=time.monotonic() + ProductNameIndex.version_check_interval + 1):
+            self.assertIsNone(product_name_index.search('apple'))
+        self.warm.assert_called()
+
+    def facet_search_queries(self, client):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('product-facet-search'), {'name': 'apple'}, format='json')
+        self.assertEqual(response.data['count'], 2)
+        return [query['sql'] for query in queries]
+
+    def test_facet_search_filters_by_ids_or_by_name(self):
+        client = APIClient()
+        client.force_authenticate(make_customer(0)[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Red Apple', categoryID=self.category, price=1, stock=1)
+        self.assertFalse([sql for sql in self.facet_search_queries(client) if 'apple' in sql.lower()])
+
+        # Too many matches to inline their ids: the name filter is used instead
+        with mock.patch('backstage.views.MAX_ID_FILTER', 1):
+            self.assertTrue([sql for sql in self.facet_search_queries(client) if 'apple' in sql.lower()])
+
+
+class ProductAutocompleteTests(TestCase):
+    def setUp(self):
+        self.category = productCategory.objects.create(name='Fruit')
+        Product.objects.bulk_create([Product(name=f'Apple {n:02}', categoryID=self.category, price=1, stock=1)
+                                     for n in range(30)])
+        self.index = ProductAutocomplete()
+        self.index.scan_limit = 5
+        self.index.load()
+
+    def names(self, prefix, limit=3):
+        return [name for _, name in self.index.complete(prefix, limit)]
+
+    def test_long_prefixes_are_ranked_when_built_and_follow_changes(self):
+        self.assertIn('ap', self.index._state.top)
+        self.assertEqual(self.names('ap'), ['Apple 00', 'Apple 01', 'Apple 02'])
+
+        pk = Product.objects.get(name='Apple 29').pk
+        self.index._state.popularity[pk] = 10
+        self.index.update(pk, 'Apple 29')
+        self.assertEqual(self.names('ap'), ['Apple 29', 'Apple 00', 'Apple 01'])
+
+        self.index.remove(pk)
+        self.assertEqual(self.names('ap'), ['Apple 00', 'Apple 01', 'Apple 02'])
+        self.assertEqual(self.names('apple 2'), ['Apple 20', 'Apple 21', 'Apple 22'])
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        self.category = productCategory.objects.create(name='Fruit')
+        self.errors = []
+
+    def run_import(self, text, file_format):
+        return import_products(read_rows(io.StringIO(text), file_format),
+                               lambda line, errors: self.errors.append((line, errors)))
+
+    def test_empty_csv_cells_of_nullable_columns_are_null(self):
+        summary = self.run_import('name,categoryID,price,stock,description,url\nApple,Fruit,1.5,10,,\n', 'csv')
+        self.assertEqual(self.errors, [])
+        self.assertEqual(summary['created'], 1)
+        product = Product.objects.get(name='Apple')
+        self.assertIsNone(product.description)
+        self.assertIsNone(product.url)
+
+    def test_update_rows_only_write_the_columns_they_supply(self):
+        product = Product.objects.create(name='Apple', categoryID=self.category, price=1.5, stock=10,
+                                         description='Crisp', url='https://example.com/apple')
+        summary = self.run_import(f'{{"id": {product.pk}, "stock": 3}}\n', 'ndjson')
+        self.assertEqual(self.errors, [])
+        self.assertEqual(summary['updated'], 1)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.name, product.description, product.url, product.categoryID_id),
+                         (3, 'Apple', 'Crisp', 'https://example.com/apple', self.category.pk))
+
+    def test_new_names_invalidate_the_indexes_of_every_process(self):
+        version = get_version(INDEX_VERSION)
+        self.run_import('{"name": "Pear", "price": 2, "stock": 1}\n', 'ndjson')
+        self.assertNotEqual(get_version(INDEX_VERSION), version)
@@ -1,19 +1,42 @@
+import codecs
+import csv
 import datetime
-import os
+import itertools
+import json
 from MySQLdb import IntegrityError
-from alipay import AliPay, AliPayConfig
-from django.db.models import Q
-from django.http import Http404, JsonResponse
+from alipay.exceptions import AliPayException
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q, F
+from django.conf import settings
+from django.http import Http404, FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, pagination
-from .models import productCategory, Product, ShoppingCart, ShoppingCartItem, Address, Order
+from .models import productCategory, Product, ShoppingCart, ShoppingCartItem, Address, Order, OrderExportJob
 from .serializers import ProductCategorySerializer, ProductSerializer, ShoppingCartItemSerializer, AddressSerializer, \
-    OrderSerializer, SimpleUserOrderSerializer, SimpleManagerOrderSerializer
-from backstage.tasks import query_order_status
+    OrderSerializer, SimpleUserOrderSerializer, SimpleManagerOrderSerializer, ShoppingCartItemDetailSerializer, \
+    OrderExportJobSerializer
+from .alipay_client import gateway_time, get_alipay_client, payment_url
+from .cart import cart_item_lines, get_cart_store
+from .caching import get_product_entry, get_category_entry, get_category_list_entry, get_stats, get_version
+from .conditional import make_etag, not_modified, set_validators
+from .exports import export_path
+from .importing import IMPORT_FORMATS, import_products, read_rows
+from .iterators import iterate_in_batches
+from .orders import STATUS_TRANSITIONS, cached_order_count, create_order_items, filter_orders, order_filter, \
+    order_filters_from, transition_orders
+from .pagination import OrderCursorPagination, get_paginator
+from .payments import PAYMENT_WINDOW, apply_trade_notification
+from .reservations import reserve_order_stock, release_order_reservations
+from .rollups import record_order_created, record_status_change, sales_dashboard
+from .search import MAX_ID_FILTER, product_name_index, product_autocomplete, product_facets
+from backstage.tasks import query_order_status, export_orders
 
 
 # Create your views here.
@@ -32,17 +55,14 @@ class ProductCategoryView(APIView):
             Token
             127.0.0.1:8000/api/categories/
         """
+        # Served through the versioned cache, category writers bump the version
         if pk:
-            try:
-                product_category = productCategory.objects.get(pk=pk)
-                serializer = ProductCategorySerializer(product_category)
-                return Response(serializer.data)
-            except productCategory.DoesNotExist:
+            entry = get_category_entry(pk)
+            if entry is None:
                 return Response(status=status.HTTP_404_NOT_FOUND)
         else:
-            product_categories = productCategory.objects.all()
-            serializer = ProductCategorySerializer(product_categories, many=True)
-            return Response(serializer.data)
+            entry = get_category_list_entry()
+        return not_modified(request, etag=entry['etag']) or set_validators(Response(entry['data']), etag=entry['etag'])
 
     def post(self, request):
         """
@@ -130,17 +150,30 @@ class ProductView(APIView):
     def get(self, request, format=None):
         """
         ### Retrieve a list of products. Pagination is applied to this endpoint with a default page size of 10.
+        ### Query Parameters:
+            pagination (string, optional): "cursor" switches to keyset pagination on id. The response then
+            contains "next"/"previous" cursor links instead of "count", and deep pages cost the same as page 1.
         ### Instance:
             127.0.0.1:8000/api/products/
+            127.0.0.1:8000/api/products/?pagination=cursor
         ###  Responses:
-            - 200 OK: Returns a list of products with pagination details.
+            - 200 OK: Returns a list of products with pagination details, and an ETag header.
+            - 304 Not Modified: The If-None-Match header matches the current ETag of the page.
             - 401 Unauthorized: If the user is not authenticated.
         """
-        products = Product.objects.all()
-        paginator = pagination.PageNumberPagination()
+        # The page only changes when a product is written or removed, or a category is renamed, and each
+        # of those bumps a cache version, so the ETag costs two cache reads and no query
+        etag = make_etag(request.get_full_path(), get_version('products'), get_version('categories'))
+        response = not_modified(request, etag=etag)
+        if response is not None:
+            return response
+
+        # The category is joined in the same query, so category_name costs no extra round trip
+        products = Product.objects.select_related('categoryID').order_by('id')
+        paginator = get_paginator(request)
         result_page = paginator.paginate_queryset(products, request)
         serializer = ProductSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return set_validators(paginator.get_paginated_response(serializer.data), etag=etag)
 
     def post(self, request, format=None):
         """
@@ -187,13 +220,119 @@ class ProductView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ProductImportAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    # Rows reported back in the response; the rest are only counted
+    max_reported_errors = 100
+
+    def post(self, request, format=None):
+        """
+        ### Bulk import products from a CSV or NDJSON file.
+        * Method: POST (multipart/form-data)
+        * Auth required: Yes (Token Authentication)
+        ### Body Parameters:
+            file: the CSV (with a header line) or NDJSON file. Columns / keys: id (optional, updates that product),
+            name, categoryID (the category name), price, stock, description, url.
+            format (string, optional): "csv" or "ndjson", guessed from the file name when omitted.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/products/import/
+            file=@catalog.csv
+        ### Success Response:
+            Code: 200 OK
+            Content: {"created": 950, "updated": 40, "failed": 10, "errors": [{"line": 12, "errors": {"price": ["A valid number is required."]}}]}
+        ### Error Response:
+            Code: 400 Bad Request (no file, or unknown format)
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "file is required."}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('format') or ('csv' if upload.name.lower().endswith('.csv') else 'ndjson')
+        if file_format not in IMPORT_FORMATS:
+            return Response({"error": f"format must be one of {', '.join(IMPORT_FORMATS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        errors = []
+
+        def on_error(line, row_errors):
+            if len(errors) < self.max_reported_errors:
+                errors.append({'line': line, 'errors': row_errors})
+
+        # The upload is decoded line by line, it is never read into memory as a whole
+        rows = read_rows(codecs.iterdecode(upload, 'utf-8-sig'), file_format)
+        summary = import_products(rows, on_error)
+        return Response({**summary, 'errors': errors})
+
+
+class ProductExportAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    export_fields = ['id', 'name', 'categoryID', 'category_name', 'price', 'stock', 'description', 'url', 'updated_at']
+
+    def get(self, request, format=None):
+        """
+        ### Stream the whole catalog with category names.
+        * Method: GET
+        * Auth required: Yes (Token Authentication)
+        ### Query Parameters:
+            type (string, optional): "ndjson" (default) or "csv".
+            updated_since (string, optional): ISO date or datetime, only products changed since then are exported.
+        ### Instance:
+            127.0.0.1:8000/api/products/export/?type=csv&updated_since=2024-03-01T00:00:00
+        ### Success Response:
+            Code: 200 OK, streamed body, one product per line.
+        ### Error Response:
+            Code: 400 Bad Request (unknown type or invalid updated_since)
+        """
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in ('ndjson', 'csv'):
+            return Response({"error": "type must be ndjson or csv."}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.all()
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            try:
+                since = parse_datetime(updated_since) or parse_date(updated_since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response({"error": "Invalid updated_since, use an ISO date or datetime."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(since, datetime.datetime):
+                since = datetime.datetime.combine(since, datetime.time.min)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            products = products.filter(updated_at__gte=since)
+
+        rows = iterate_in_batches(products.annotate(category_name=F('categoryID__name')).values(*self.export_fields))
+        if export_type == 'csv':
+            writer = csv.writer(_Echo())
+            lines = itertools.chain([writer.writerow(self.export_fields)],
+                                    (writer.writerow([row[field] for field in self.export_fields]) for row in rows))
+            content_type = 'text/csv'
+        else:
+            lines = (json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{export_type}"'
+        return response
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each formatted line back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
 class ProductDetailView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_object(self, id):
         try:
-            return Product.objects.get(id=id)
+            return Product.objects.select_related('categoryID').get(id=id)
         except Product.DoesNotExist:
             raise Http404
 
@@ -216,9 +355,11 @@ class ProductDetailView(APIView):
 
         """
 
-        product = self.get_object(id)
-        serializer = ProductSerializer(product)
-        return Response(serializer.data)
+        # Served through the versioned cache, product writers bump the version
+        entry = get_product_entry(id)
+        if entry is None:
+            raise Http404
+        return not_modified(request, etag=entry['etag']) or set_validators(Response(entry['data']), etag=entry['etag'])
 
     def put(self, request, id, format=None):
         """
@@ -314,10 +455,17 @@ class ProductSearchAPIView(APIView):
             """
         name_query = request.data.get('name', None)
         if name_query is not None:
-            # Case-insensitive searches using icontains
-            products = Product.objects.filter(name__icontains=name_query)
             paginator = pagination.PageNumberPagination()
-            result_page = paginator.paginate_queryset(products, request)
+            product_ids = product_name_index.search(str(name_query))
+            if product_ids is None:
+                # Index is cold or the query is too short for it: case-insensitive search using icontains
+                products = Product.objects.filter(name__icontains=name_query).select_related('categoryID').order_by('id')
+                result_page = paginator.paginate_queryset(products, request)
+            else:
+                # Page over the matching ids and only load the products of the current page
+                page_ids = paginator.paginate_queryset(product_ids, request)
+                products = Product.objects.select_related('categoryID').in_bulk(page_ids)
+                result_page = [products[pk] for pk in page_ids if pk in products]
             serializer = ProductSerializer(result_page, many=True)
             return paginator.get_paginated_response(serializer.data)
         else:
@@ -338,7 +486,7 @@ class ProductSearchAPIView(APIView):
         """
         category = request.query_params.get("category", None)
         if category is not None:
-            products = Product.objects.filter(categoryID=category).order_by("id")
+            products = Product.objects.filter(categoryID=category).select_related('categoryID').order_by("id")
             paginator = pagination.PageNumberPagination()
             result_page = paginator.paginate_queryset(products, request)
             serializer = ProductSerializer(result_page, many=True)
@@ -346,6 +494,111 @@ class ProductSearchAPIView(APIView):
         else:
             return Response({"message": "category parameter is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
+class ProductFacetSearchAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        ### Description:
+            Search products by any combination of name, categories, price range and stock, and return
+            the page of results together with per-category counts and a price histogram.
+            Category counts ignore the category filter and the histogram ignores the price filter, so the UI
+            can show how many products each other choice would give.
+        ### Body Parameters:
+            name (string, optional): part of the product name, case-insensitive.
+            categories (list of integers, optional): category ids.
+            min_price (number, optional), max_price (number, optional): inclusive price range.
+            in_stock (boolean, optional): only products with stock left.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/search/products/facets/
+            {
+                "name": "kit",
+                "categories": [2, 3],
+                "min_price": 5,
+                "max_price": 30,
+                "in_stock": true
+            }
+        ### Responses:
+            200 OK: The paginated results plus
+                "facets": {"categories": [{"id": 2, "name": "Vegetarian", "count": 12}],
+                           "price": [{"range": "0-5", "count": 3}, {"range": "5-10", "count": 7}, ...]}
+            400 Bad Request: Invalid categories or price range.
+        """
+        name = request.data.get('name')
+        in_stock = request.data.get('in_stock') in (True, 'true', '1', 1)
+        try:
+            categories = [int(category) for category in request.data.get('categories') or []]
+            min_price = request.data.get('min_price')
+            max_price = request.data.get('max_price')
+            min_price = float(min_price) if min_price not in (None, '') else None
+            max_price = float(max_price) if max_price not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({"message": "Invalid categories or price range."}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.all()
+        if name:
+            product_ids = product_name_index.search(str(name))
+            if product_ids is None or len(product_ids) > MAX_ID_FILTER:
+                # Also used by the facet queries, a long id list would be sent with each of them
+                products = products.filter(name__icontains=name)
+            else:
+                products = products.filter(id__in=product_ids)
+        if in_stock:
+            products = products.filter(stock__gt=F('reserved'))
+
+        price_filter = Q()
+        if min_price is not None:
+            price_filter &= Q(price__gte=min_price)
+        if max_price is not None:
+            price_filter &= Q(price__lte=max_price)
+        category_filter = Q(categoryID__in=categories) if categories else Q()
+
+        facets = product_facets(products, categories, price_filter or None)
+        results = products.filter(category_filter & price_filter).select_related('categoryID').order_by('id')
+        paginator = pagination.PageNumberPagination()
+        result_page = paginator.paginate_queryset(results, request)
+        serializer = ProductSerializer(result_page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['facets'] = facets
+        return response
+
+
+class ProductAutocompleteAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        ### Description:
+            Product names starting with the typed prefix, most sold first. Meant to be called on every keystroke
+            of the search box; answers come from an in-memory index, not from the database.
+        ### Query Parameters:
+            q (string, required): the prefix, case-insensitive.
+            limit (integer, optional): number of suggestions, default 10, at most 20.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/search/autocomplete/?q=veg&limit=5
+        ### Responses:
+            200 OK: {"results": [{"id": 4, "name": "Vegetable Kit"}, {"id": 9, "name": "Vegan Box"}]}
+            400 Bad Request: q is missing or limit is not a positive integer.
+        """
+        prefix = request.query_params.get('q', '').strip()
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not prefix or limit < 1:
+            return Response({"message": "q is required and limit must be a positive integer."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        suggestions = product_autocomplete.complete(prefix, limit)
+        if suggestions is None:
+            # Index still warming up
+            limit = min(limit, product_autocomplete.max_limit)
+            suggestions = Product.objects.filter(name__istartswith=prefix).order_by('name').values_list('id', 'name')[:limit]
+        return Response({"results": [{"id": pk, "name": name} for pk, name in suggestions]})
+
+
 class ShoppingCartView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
@@ -399,25 +652,18 @@ class ShoppingCartItemListCreate(APIView):
 
 
         """
-        items = ShoppingCartItem.objects.filter(cartID__id=cart_id)
-        if not items.exists():
+        # Pending changes of a Redis-held cart are written back first
+        get_cart_store().flush(cart_id)
+        # One joined query: the products come with the items and each line total is computed by the database
+        items = list(cart_item_lines(ShoppingCartItem.objects.filter(cartID_id=cart_id)))
+        if not items:
             return Response({"error": "Shopping cart not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = ShoppingCartItemSerializer(items, many=True)
-
-        total_final_price = 0  # Initialise the sum of the final prices
-        items_with_final_price = []
-        for item in serializer.data:
-            final_price = item['quantity'] * item['product_detail']['price']
-            item_with_final_price = item  # Copy to
-            item_with_final_price['final_price'] = final_price
-            items_with_final_price.append(item_with_final_price)
-            total_final_price += final_price  # Accumulate the final price into the sum
-
-        total_final_price = round(total_final_price, 2)
+        serializer = ShoppingCartItemDetailSerializer(items, many=True)
+        total_final_price = round(sum(item.final_price for item in items), 2)
         # Constructing the response data, including details of all items and the sum of the final prices
         response_data = {
-            'items': items_with_final_price,
+            'items': serializer.data,
             'total_final_price': total_final_price
         }
 
@@ -450,20 +696,62 @@ class ShoppingCartItemListCreate(APIView):
         if serializer.is_valid():
             try:
                 cart = ShoppingCart.objects.get(id=cart_id)
-                product_id = request.data.get('productID')
-                product = Product.objects.get(id=product_id)
+                # Already loaded by the serializer's validation
+                product = serializer.validated_data['productID']
                 # Checking the adequacy of stock
                 requested_quantity = serializer.validated_data.get('quantity')
-                if requested_quantity > product.stock:
-                    return Response({'quantity': f'Requested quantity exceeds available stock of {product.stock}.'},
+                if requested_quantity > product.available_stock:
+                    return Response({'quantity': f'Requested quantity exceeds available stock of {product.available_stock}.'},
                                     status=status.HTTP_400_BAD_REQUEST)
-                serializer.save(cartID=cart, productID=product)
+                # Insert or increment in one statement guarded by the stock (see ShoppingCartItem.add_to_cart),
+                # or in the cart's Redis hash with the redis cart backend
+                get_cart_store().add(cart.id, product.id, requested_quantity)
                 return Response({"message": "Add to shopping cart successfully!"}, status=status.HTTP_201_CREATED)
-            except (Product.DoesNotExist, ShoppingCart.DoesNotExist):
+            except ShoppingCart.DoesNotExist:
                 return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ShoppingCartItemBatchAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, cart_id, format=None):
+        """
+        ### Apply several changes to a Shopping Cart at once
+        * Method: POST
+        ### URL Parameters:
+            cart_id: The ID of the specified shopping cart.
+        ### Data Parameters (Request Body):
+            operations: list of operations, applied in order:
+                {"op": "add", "productID": 4, "quantity": 2}    add to the quantity in the cart
+                {"op": "set", "productID": 5, "quantity": 1}    replace the quantity in the cart
+                {"op": "remove", "productID": 6}                remove the product from the cart
+        ### Instance:
+            127.0.0.1:8000/api/shopping-cart-items/cart/1/batch/
+            {
+                "operations": [
+                    {"op": "add", "productID": 4, "quantity": 2},
+                    {"op": "remove", "productID": 6}
+                ]
+            }
+        ### Success Response:
+            Code: 200 OK
+            Content: {"results": [{"index": 0, "productID": 4, "status": "ok", "quantity": 3},
+                                  {"index": 1, "productID": 6, "status": "error", "error": "Product is not in the cart."}]}
+            Operations that fail are skipped, the others are applied.
+        ### Error Response:
+            Code: 400 Bad Request (operations is not a list)
+            Code: 404 Not Found (If the specified shopping cart does not exist)
+        """
+        operations = request.data.get('operations')
+        if not isinstance(operations, list):
+            return Response({'error': 'operations must be a list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ShoppingCart.objects.filter(id=cart_id).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response({'results': get_cart_store().apply(cart_id, operations)})
+
+
 class ShoppingCartItemByProductDetail(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
@@ -483,6 +771,9 @@ class ShoppingCartItemByProductDetail(APIView):
         Code: 404 Not Found (If the specified shopping cart item does not exist).
         """
         cart_item = get_object_or_404(ShoppingCartItem, pk=pk)
+        if get_cart_store().flush(cart_item.cartID_id):
+            # The row was behind the cart's Redis hash, read it again
+            cart_item = get_object_or_404(ShoppingCartItem, pk=pk)
         # Return only the quantity of the shopping cart item
         return Response({'quantity': cart_item.quantity})
 
@@ -507,8 +798,7 @@ class ShoppingCartItemByProductDetail(APIView):
         # Only allow updating the quantity
         quantity = request.data.get('quantity')
         if quantity is not None:
-            cart_item.quantity = quantity
-            cart_item.save()
+            get_cart_store().set(cart_item, quantity)
             return Response({'message': "Update successfully!"}, status=status.HTTP_200_OK)
         else:
             return Response({'error': 'Quantity is required.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -528,7 +818,7 @@ class ShoppingCartItemByProductDetail(APIView):
 
         """
         cart_item = get_object_or_404(ShoppingCartItem, pk=pk)
-        cart_item.delete()
+        get_cart_store().remove(cart_item)
         return Response({"message": "Delete Successfully"}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -673,9 +963,10 @@ class UserOrderOneAPIView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
-    def get_object(self, user_id, pk):
+    def get_object(self, user_id, pk, lock=False):
+        orders = Order.objects.select_for_update() if lock else Order.objects
         try:
-            return Order.objects.get(id=pk, user_id=user_id)
+            return orders.get(id=pk, user_id=user_id)
         except Order.DoesNotExist:
             raise Http404
 
@@ -694,8 +985,12 @@ class UserOrderOneAPIView(APIView):
             404 Not Found: The specified order does not exist. An appropriate error message is included in the response body.
         """
         order = self.get_object(user_id, pk)
+        etag = make_etag('order', order.pk, order.updated_at)
+        response = not_modified(request, etag=etag, last_modified=order.updated_at)
+        if response is not None:
+            return response
         serializer = OrderSerializer(order)
-        return Response(serializer.data)
+        return set_validators(Response(serializer.data), etag=etag, last_modified=order.updated_at)
 
     def put(self, request, user_id, pk):
         """
@@ -711,10 +1006,16 @@ class UserOrderOneAPIView(APIView):
             200 OK: The order was successfully updated to 'cancel'. The response body includes a success message and the updated order details.
             400 Bad Request: The request failed. An error message is included in the response body.
         """
-        order = self.get_object(user_id, pk)
-        order.status = 'cancel'
         try:
-            order.save()
+            with transaction.atomic():
+                # Read the status under the row lock, a payment landing meanwhile waits for the cancel or wins
+                order = self.get_object(user_id, pk, lock=True)
+                previous_status = order.status
+                order.status = 'cancel'
+                order.save(update_fields=['status', 'updated_at'])
+                # Give the units held for this order back
+                release_order_reservations([order.id])
+                record_status_change(order, previous_status)
             serializer = OrderSerializer(order)
             return Response({'message': "Update successfully!", 'order': serializer.data}, status=status.HTTP_200_OK)
         except IntegrityError:
@@ -734,19 +1035,19 @@ class UserOrderOneAPIView(APIView):
             200 OK: The order was successfully marked as completed. The response body includes a success message, and the updated order details.
             400 Bad Request: The request failed due to the order not being in a 'delivered' status or other issues. An error message is included in the response body.
         """
-        order = self.get_object(user_id, pk)
-        if order.status == 'delivered':
-            order.status = 'done'
-            now = datetime.datetime.now()
-            order.finishTime = now
-            try:
-                order.save()
-                serializer = OrderSerializer(order)
-                return Response({'message': "Your order have been done! Thanks! ", 'order': serializer.data},
-                                status=status.HTTP_200_OK)
-            except IntegrityError:
-                return Response({'message': "Unsuccessfully!"}, status=status.HTTP_400_BAD_REQUEST)
-        else:
+        try:
+            with transaction.atomic():
+                order = self.get_object(user_id, pk, lock=True)
+                if order.status != 'delivered':
+                    return Response({'message': "Unsuccessfully!"}, status=status.HTTP_400_BAD_REQUEST)
+                order.status = 'done'
+                order.finishTime = datetime.datetime.now()
+                order.save(update_fields=['status', 'finishTime', 'updated_at'])
+                record_status_change(order, 'delivered')
+            serializer = OrderSerializer(order)
+            return Response({'message': "Your order have been done! Thanks! ", 'order': serializer.data},
+                            status=status.HTTP_200_OK)
+        except IntegrityError:
             return Response({'message': "Unsuccessfully!"}, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -758,21 +1059,36 @@ class ManagerOrderOneAPIView(APIView):
         """
         ### Description:
             Retrieves a paginated list of all orders sorted by their ID.
+        ### Query Parameters:
+            pagination (string, optional): "cursor" switches to keyset pagination on (createTime, id), newest first.
+            The response then contains "next"/"previous" cursor links and no exact count.
+            count (string, optional): "true" adds "count" to cursor pages, refreshed at most once a minute.
         ### Instance:
             URL:127.0.0.1:8000/api/manager/orders/
+            URL:127.0.0.1:8000/api/manager/orders/?pagination=cursor&count=true
         ### Responses:
             200 OK: Successfully retrieved a list of orders. The response is paginated and includes order details based on the SimpleManagerOrderSerializer.
         """
         orders = Order.objects.all().order_by('id')
-        paginator = pagination.PageNumberPagination()
+        return self.paginate(request, orders, {})
+
+    def paginate(self, request, orders, filters):
+        """
+        Page-number pages by default. `?pagination=cursor` switches to keyset pages on (createTime, id),
+        which skip the COUNT(*); `&count=true` then adds the total, served from a counter cached per filter.
+        """
+        paginator = get_paginator(request, OrderCursorPagination)
         result_page = paginator.paginate_queryset(orders, request)
         serializer = SimpleManagerOrderSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        response = paginator.get_paginated_response(serializer.data)
+        if isinstance(paginator, OrderCursorPagination) and request.query_params.get('count') == 'true':
+            response.data['count'] = cached_order_count(filters)
+        return response
 
     def put(self, request):
         """
         ### Description:
-            Updates the status of a specified order to 'delivered', provided the order has been paid.
+            Updates the status of a specified order to 'delivered', provided the order has been paid and is 'processing'.
         ### Request Body:
             id (integer): The unique identifier of the order to update.
         ### Instance:
@@ -780,26 +1096,31 @@ class ManagerOrderOneAPIView(APIView):
             {"id":"14"}
         ### Responses:
             200 OK: Successfully updated the order status to 'delivered'. The response includes a success message and the updated order details.
-            400 Bad Request: The request failed due to the order not being paid or other issues. An error message is included in the response body.
+            400 Bad Request: The request failed due to the order not being paid or not being in 'processing' status. An error message is included in the response body.
+            404 Not Found: The order does not exist.
         """
         pk = request.data.get('id')
-        order = Order.objects.get(id=pk)
-        if order.isPaid:
-            order.status = 'delivered'
-            try:
-                order.save()
-                serializer = OrderSerializer(order)
-                return Response({'message': "Update successfully!", 'order': serializer.data},
-                                status=status.HTTP_200_OK)
-            except IntegrityError:
-                return Response({'message': "Unsuccessfully!"}, status=status.HTTP_400_BAD_REQUEST)
-        else:
+        # Compare-and-set on status and isPaid, only the changed columns are written
+        transitioned = transition_orders([pk], 'delivered')
+        order = get_object_or_404(Order, id=pk)
+        if transitioned:
+            serializer = OrderSerializer(order)
+            return Response({'message': "Update successfully!", 'order': serializer.data},
+                            status=status.HTTP_200_OK)
+        elif not order.isPaid:
             return Response({'message': "Customer need to finish the payment !"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            return Response({'message': f"Order is {order.status}, it cannot be delivered."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
     def post(self, request, *args, **kwargs):
         """
         ### Description:
             Allows for filtering orders based on user ID, a list of statuses, and a creation date range. It returns a paginated list of orders that match the specified criteria.
+        ### Query Parameters:
+            pagination (string, optional): "cursor" switches to keyset pagination on (createTime, id), newest first.
+            The response then contains "next"/"previous" cursor links and no exact count.
+            count (string, optional): "true" adds "count" to cursor pages, refreshed at most once a minute.
         ### Request Body:
             user_id (integer, optional): The unique identifier of the user whose orders to filter.
             statuses (list of strings, optional): A list of order statuses to filter by.
@@ -817,36 +1138,162 @@ class ManagerOrderOneAPIView(APIView):
             200 OK: Successfully retrieved a filtered list of orders. The response is paginated and includes order details based on the criteria specified in the request body.
             400 Bad Request: The request failed due to invalid input or other issues. An error message is included in the response body.
         """
-        from datetime import datetime
+        filters = order_filters_from(request.data)
+        try:
+            orders = Order.objects.filter(order_filter(**filters)).order_by('id')
+        except ValueError:
+            return Response({"error": "Invalid date format. Please use YYYY-MM-DD."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return self.paginate(request, orders, filters)
 
-        user_id = request.data.get('user_id', None)
-        statuses = request.data.get('statuses', [])  # Now accepting the status list
-        start_date = request.data.get('start_date', None)
-        end_date = request.data.get('end_date', None)
 
-        queries = Q()
+class ManagerOrderBulkStatusAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_ids = 10000
 
-        # User ID Query Criteria
-        if user_id is not None:
-            queries &= Q(user_id=user_id)
+    def post(self, request):
+        """
+        ### Description:
+            Moves many paid orders to a new status at once, e.g. marks a whole shipment batch as delivered.
+            'delivered' applies to 'processing' orders and 'done' to 'delivered' ones; other orders are left as they are
+            and reported as skipped. The change is a single conditional UPDATE, so it never overwrites concurrent changes.
+        ### Request Body:
+            ids (list of integers): The orders to move, at most 10000.
+            status (string): "delivered" or "done".
+        ### Instance:
+            URL: 127.0.0.1:8000/api/manager/orders/status/
+            {"ids": [14, 15, 16], "status": "delivered"}
+        ### Responses:
+            200 OK: {"transitioned": [14, 16], "skipped": [15]}
+            400 Bad Request: Unknown target status, or ids is not a list of integers.
+        """
+        target = request.data.get('status')
+        if target not in STATUS_TRANSITIONS:
+            return Response({"error": f"status must be one of {', '.join(STATUS_TRANSITIONS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        ids = request.data.get('ids')
+        try:
+            if not isinstance(ids, list):
+                raise TypeError
+            ids = list(dict.fromkeys(int(pk) for pk in ids))
+        except (TypeError, ValueError):
+            return Response({"error": "ids must be a list of integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_ids:
+            return Response({"error": f"At most {self.max_ids} ids per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        transitioned = set(transition_orders(ids, target))
+        return Response({
+            'transitioned': [pk for pk in ids if pk in transitioned],
+            'skipped': [pk for pk in ids if pk not in transitioned],
+        })
+
+
+class ManagerSalesDashboardAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    default_days = 30
 
-        # Multiple status query conditions
-        if statuses:
-            queries &= Q(status__in=statuses)  # Use __in to filter multiple states
+    def get(self, request):
+        """
+        ### Description:
+            Sales overview for managers: orders and revenue per day, orders per status and the best selling products.
+            Read from the daily rollup tables only, so the cost does not depend on the number of orders.
+        ### Query Parameters:
+            start_date (string, optional): First day, YYYY-MM-DD. Defaults to 30 days before end_date.
+            end_date (string, optional): Last day, YYYY-MM-DD. Defaults to today.
+            top (integer, optional): Number of products to return, default 10, at most 100.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/manager/dashboard/?start_date=2024-03-01&end_date=2024-03-31
+        ### Responses:
+            200 OK: {"days": [{"date": "2024-03-01", "orders": 12, "revenue": 310.5}], "statuses": {"done": 9, "unpaid": 3},
+                     "top_products": [{"id": 4, "name": "Apple", "units": 40, "revenue": 52.0}]}
+            400 Bad Request: A date or the top parameter is invalid.
+        """
+        try:
+            end = parse_date(request.query_params.get('end_date', '')) if request.query_params.get('end_date') \
+                else timezone.localdate()
+            start = parse_date(request.query_params.get('start_date', '')) if request.query_params.get('start_date') \
+                else end - datetime.timedelta(days=self.default_days)
+            top = min(int(request.query_params.get('top', 10)), 100)
+        except ValueError:
+            return Response({"error": "Invalid parameters."}, status=status.HTTP_400_BAD_REQUEST)
+        if start is None or end is None:
+            return Response({"error": "Invalid date format. Please use YYYY-MM-DD."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(sales_dashboard(start, end, top))
+
+
+class OrderExportAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
 
-        # Create a time range query condition
-        if start_date and end_date:
-            start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
-            end_datetime = datetime.strptime(end_date, "%Y-%m-%d")
-            queries &= Q(createTime__range=(start_datetime, end_datetime))
+    def post(self, request):
+        """
+        ### Description:
+            Starts a background CSV export of the orders matching the same filters as the manager order search.
+            The file is written by a Celery task; poll the job until its status is "done", then download it.
+        ### Request Body:
+            user_id (integer, optional), statuses (list of strings, optional), start_date and end_date (YYYY-MM-DD, optional).
+        ### Instance:
+            URL: 127.0.0.1:8000/api/manager/orders/exports/
+            {"statuses": ["done"], "start_date": "2024-01-01", "end_date": "2024-03-31"}
+        ### Responses:
+            202 Accepted: The job was queued. The response body is the job, with its id.
+            400 Bad Request: A date is malformed.
+        """
+        filters = order_filters_from(request.data)
+        try:
+            order_filter(**filters)
+        except ValueError:
+            return Response({"error": "Invalid date format. Please use YYYY-MM-DD."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        job = OrderExportJob.objects.create(user=request.user, filters=filters)
+        transaction.on_commit(lambda: export_orders.delay(job.id))
+        return Response(OrderExportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
-        # executing query
-        orders = Order.objects.filter(queries).order_by('id')
 
-        paginator = pagination.PageNumberPagination()
-        result_page = paginator.paginate_queryset(orders, request)
-        serializer = SimpleManagerOrderSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+class OrderExportDetailAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        """
+        ### Description:
+            Status and progress of an order export job: "rows" written so far out of "total".
+        ### Instance:
+            URL: 127.0.0.1:8000/api/manager/orders/exports/3/
+        ### Responses:
+            200 OK: {"id": 3, "status": "running", "rows": 42000, "total": 120000, ...}
+            404 Not Found: The job does not exist.
+        """
+        job = get_object_or_404(OrderExportJob, pk=pk)
+        return Response(OrderExportJobSerializer(job).data)
+
+
+class OrderExportDownloadAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        """
+        ### Description:
+            Downloads the gzip-compressed CSV of a finished order export job.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/manager/orders/exports/3/download/
+        ### Responses:
+            200 OK: The file, as an attachment.
+            404 Not Found: The job does not exist or its file is gone.
+            409 Conflict: The export has not finished yet.
+        """
+        job = get_object_or_404(OrderExportJob, pk=pk)
+        if job.status != 'done':
+            return Response({"error": f"Export is {job.status}."}, status=status.HTTP_409_CONFLICT)
+        try:
+            file = open(export_path(job), 'rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(file, as_attachment=True, filename=job.file_name, content_type='application/gzip')
 
 
 class UserOrderAPIView(APIView):
@@ -897,31 +1344,13 @@ class UserOrderAPIView(APIView):
             200 OK: Successfully retrieved a filtered list of orders for the user. The response is paginated and includes details of each order that matches the filter criteria.
             400 Bad Request: The request failed due to invalid input, such as an incorrect date format. An error message detailing the reason for failure is included in the response body.
         """
-        from datetime import datetime
-        statuses = request.data.get('statuses', [])  # Now accepting the status list
-        start_date = request.data.get('start_date', None)
-        end_date = request.data.get('end_date', None)
-
         # Basic query: User ID
         if user_id is not None:
-            queries = Q(user_id=user_id)
-
-            # Status query condition (if provided)
-            if statuses:
-                queries &= Q(status__in=statuses)
-
-            # Create a time range query condition (if start and end dates are provided)
-            if start_date and end_date:
-                try:
-                    start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
-                    end_datetime = datetime.strptime(end_date, "%Y-%m-%d")
-                    queries &= Q(createTime__range=(start_datetime, end_datetime))
-                except ValueError:
-                    return Response({"error": "Invalid date format. Please use YYYY-MM-DD."},
-                                    status=status.HTTP_400_BAD_REQUEST)
-
-            # perform a search
-            orders = Order.objects.filter(queries).order_by('id')
+            try:
+                orders = filter_orders(request.data, user_id=user_id).order_by('id')
+            except ValueError:
+                return Response({"error": "Invalid date format. Please use YYYY-MM-DD."},
+                                status=status.HTTP_400_BAD_REQUEST)
 
             paginator = pagination.PageNumberPagination()
             result_page = paginator.paginate_queryset(orders, request)
@@ -966,36 +1395,43 @@ class UserOrderCreateAPIView(APIView):
             # Serialising address information
         address_serializer = AddressSerializer(address)
 
-        items = ShoppingCartItem.objects.filter(cartID_id=cart)
-        if not items.exists():
-            return Response({"error": "Shopping cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
-
-        serializer = ShoppingCartItemSerializer(items, many=True)
-
-        total_final_price = 0  # Initialise the sum of the final prices
-        items_with_final_price = []
-        for item in serializer.data:
-            final_price = item['quantity'] * item['product_detail']['price']
-            item_with_final_price = item
-            item_with_final_price['final_price'] = final_price
-            items_with_final_price.append(item_with_final_price)
-            total_final_price += final_price
-
-        order_data = {
-            'user': user_id,
-            'item': items_with_final_price,
-            'totalCost': total_final_price,
-            'address': address_serializer.data
-        }
-
-        order_serializer = OrderSerializer(data=order_data)
-        if order_serializer.is_valid():
-            order_serializer.save()
-            # Empty Shopping Cart
-            items.delete()
-            return Response(order_serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(order_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Checkout needs the rows, write back a Redis-held cart now
+        cart_store = get_cart_store()
+        cart_store.flush(cart.id)
+
+        # The order, the stock holds and the emptied cart are committed together or not at all
+        with transaction.atomic():
+            # Serialises checkouts of the same cart: a double submit waits here, then finds the cart empty
+            ShoppingCart.objects.select_for_update().filter(pk=cart.id).exists()
+            # Items, their products and line totals in one joined query
+            items = list(cart_item_lines(ShoppingCartItem.objects.filter(cartID_id=cart.id)))
+            if not items:
+                return Response({"error": "Shopping cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
+
+            quantities = {}
+            for item in items:
+                quantities[item.productID_id] = quantities.get(item.productID_id, 0) + item.quantity
+
+            order_data = {
+                'user': user_id,
+                'item': ShoppingCartItemDetailSerializer(items, many=True).data,
+                'totalCost': sum(item.final_price for item in items),
+                'address': address_serializer.data
+            }
+            order_serializer = OrderSerializer(data=order_data)
+            if not order_serializer.is_valid():
+                return Response(order_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            order = order_serializer.save()
+            # Locks the products and holds the units until the order is paid or the hold expires;
+            # raises a 400 and rolls the order back when the stock is short
+            reserve_order_stock(order, quantities)
+            create_order_items(order, items)
+            record_order_created(order)
+            # Empty Shopping Cart, only the lines this order was built from
+            ShoppingCartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+
+        cart_store.clear(cart.id)
+        return Response(order_serializer.data, status=status.HTTP_201_CREATED)
 
 
 class AliPayAPIView(APIView):
@@ -1014,55 +1450,84 @@ class AliPayAPIView(APIView):
             URL: 127.0.0.1:8000/api/alipay/10/14/
         ### Responses:
             200 OK: Successfully generated the AliPay payment URL. The response includes the pay_url which can be used to redirect the user to complete the payment.
+            400 Bad Request: The order is already paid or cancelled, or its stock hold has expired. An error message is included in the response body.
             404 Not Found: The specified order does not exist. An appropriate error message is included in the response body.
         """
 
-        # Get the absolute path to the current working directory
-        current_working_directory = os.getcwd()
-
-        # Absolute path to build to a specific file
-        app_private_key_path = os.path.join(current_working_directory, 'backstage', 'PrivateKey.txt')
-        alipay_public_key_path = os.path.join(current_working_directory, 'backstage', 'alipayPublicCert.txt')
-
-        # Open and read files securely using the with statement
-        with open(app_private_key_path, 'r') as file:
-            app_private_key_string = file.read()
-
-        with open(alipay_public_key_path, 'r') as file:
-            alipay_public_key_string = file.read()
-
-        # Output path, for validation only
-        print("App Private Key Path:", app_private_key_path)
-        print("Alipay Public Key Path:", alipay_public_key_path)
-
-
-        alipay = AliPay(
-            appid="9021000129661967",
-            app_notify_url=None,  # Do not receive asynchronous notifications
-            app_private_key_string=app_private_key_string,
-            alipay_public_key_string=alipay_public_key_string,
-            sign_type="RSA2",
-            debug=True,
-            config=AliPayConfig(timeout=15)
-        )
-
         order = Order.objects.get(id=pk, user_id=user_id)
+        # The trade closes when the stock hold expires, so no payment can land after the units were released
+        expires_at = order.createTime + PAYMENT_WINDOW
+        if order.status != 'unpaid' or order.isPaid or expires_at <= timezone.now():
+            return Response({"error": "This order can no longer be paid."}, status=status.HTTP_400_BAD_REQUEST)
 
         rounded_number = round(order.totalCost, 2)
         # Generate payment url
-        order_string = alipay.api_alipay_trade_page_pay(
+        order_string = get_alipay_client().api_alipay_trade_page_pay(
             out_trade_no=order.id,
             total_amount=str(rounded_number),  # Convert Decimal to String Pass
             subject="P",
             return_url=None,  # Doesn't care about the page jump after the user completes payment
-            notify_url=None
+            notify_url=None,
+            time_expire=gateway_time(expires_at)
         )
 
         # Sandboxed environments with sandboxed gateways
-        pay_url = f"https://openapi-sandbox.dl.alipaydev.com/gateway.do?{order_string}"
+        pay_url = payment_url(order_string)
 
-        query_order_status.delay(order.id)
+        if not settings.ALIPAY_NOTIFY_URL:
+            # No notifications without a public notify URL, check the payment from here
+            query_order_status.delay(order.id)
         # print(add.delay(10,5))
 
         # Returns the payment link directly to the front-end without a page jump
         return Response({"pay_url": pay_url})
+
+
+class AliPayNotifyAPIView(APIView):
+    # Called by the gateway, which authenticates with its signature instead of a token
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        """
+        ### Description:
+            Asynchronous trade notification from AliPay (settings.ALIPAY_NOTIFY_URL must point here).
+            The signature is verified with the AliPay public key before anything is trusted; a paid trade then marks its
+            order paid and deducts the stock in one transaction. Marking is idempotent, so repeated notifications and
+            the fallback poller cannot deduct the stock twice.
+        ### Request Body:
+            Form-encoded notification parameters, including sign, out_trade_no, total_amount and trade_status.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/alipay/notify/
+        ### Responses:
+            200 OK: "success" once the notification has been handled, as the gateway expects; it retries anything else.
+            400 Bad Request: "failure", the signature or the order does not match.
+        """
+        params = request.POST.dict()
+        signature = params.pop("sign", None)
+        try:
+            verified = bool(signature) and get_alipay_client().verify(params, signature)
+        except (AliPayException, ValueError):
+            # Another sign_type than the client's, or a signature that is not even base64
+            verified = False
+        if not verified:
+            return HttpResponse("failure", status=status.HTTP_400_BAD_REQUEST, content_type='text/plain')
+        if not apply_trade_notification(params):
+            return HttpResponse("failure", status=status.HTTP_400_BAD_REQUEST, content_type='text/plain')
+        return HttpResponse("success", content_type='text/plain')
+
+
+class CatalogCacheStatsAPIView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        ### Description:
+            Hit and miss counters of the product and category read-through cache, for monitoring.
+        ### Instance:
+            URL: 127.0.0.1:8000/api/cache/stats/
+        ### Responses:
+            200 OK: {"product": {"hits": 120, "misses": 8}, "category": {"hits": 40, "misses": 2}}
+        """
+        return Response(get_stats())
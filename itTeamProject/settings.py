@@ -94,6 +94,52 @@ TEMPLATES = [
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
 CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/0'
 
+CELERY_BEAT_SCHEDULE = {
+    'flush-dirty-carts': {
+        'task': 'backstage.tasks.flush_dirty_carts',
+        'schedule': 30.0,
+    },
+    'sweep-expired-reservations': {
+        'task': 'backstage.tasks.sweep_expired_reservations',
+        'schedule': 60.0,
+    },
+    'poll-pending-payments': {
+        'task': 'backstage.tasks.poll_pending_payments',
+        'schedule': 60.0,
+    },
+    # Settles the orders left unpaid after their payment window: closed or never opened trades are cancelled
+    'reconcile-payments': {
+        'task': 'backstage.tasks.reconcile_payments',
+        'schedule': 60 * 60.0,
+    },
+}
+
+# 'database' keeps carts in ShoppingCartItem only, 'redis' keeps active carts in Redis hashes
+# and writes them back to ShoppingCartItem asynchronously (backstage.cart.RedisCartStore)
+CART_BACKEND = 'database'
+CART_REDIS_URL = 'redis://127.0.0.1:6379/2'
+
+# AliPay sandbox application, key paths are relative to the backstage package (backstage.alipay_client)
+ALIPAY_APPID = "9021000129661967"
+ALIPAY_PRIVATE_KEY_PATH = 'PrivateKey.txt'
+ALIPAY_PUBLIC_KEY_PATH = 'alipayPublicCert.txt'
+# Public URL of api/alipay/notify/. When set, the gateway notifies payments and polling is only the
+# fallback done by the poll-pending-payments beat task
+ALIPAY_NOTIFY_URL = None
+ALIPAY_DEBUG = True
+ALIPAY_GATEWAY = 'https://openapi-sandbox.dl.alipaydev.com/gateway.do'
+
+# Where the order export task writes its gzip-compressed CSV files
+EXPORT_ROOT = BASE_DIR / 'exports'
+
+# Shared cache, so that catalog cache versions bumped by one process are seen by all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    }
+}
+
 WSGI_APPLICATION = "itTeamProject.wsgi.application"
 
 # Database
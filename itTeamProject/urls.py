@@ -19,7 +19,10 @@ from django.urls import path, include
 from eShop.views import RegisterView, LoginView, SendVerificationCodeView, UpdateUserAPIView, ChangePasswordView
 from backstage.views import ProductCategoryView, ProductView, ProductDetailView, ShoppingCartView, \
     ShoppingCartItemByProductDetail, ShoppingCartItemListCreate, AddressList, AddressDetail,UserOrderAPIView, UserOrderOneAPIView, AliPayAPIView, \
-    ManagerOrderOneAPIView, UserOrderCreateAPIView, ProductSearchAPIView
+    ManagerOrderOneAPIView, UserOrderCreateAPIView, ProductSearchAPIView, CatalogCacheStatsAPIView, \
+    ProductImportAPIView, ProductExportAPIView, ProductFacetSearchAPIView, ProductAutocompleteAPIView, \
+    ShoppingCartItemBatchAPIView, ManagerSalesDashboardAPIView, OrderExportAPIView, OrderExportDetailAPIView, \
+    OrderExportDownloadAPIView, ManagerOrderBulkStatusAPIView, AliPayNotifyAPIView
 from rest_framework.schemas import get_schema_view
 from rest_framework.documentation import include_docs_urls
 
@@ -35,13 +38,19 @@ urlpatterns = [
     path('api/categories/', ProductCategoryView.as_view(), name='category-list-create'),
     path('api/categories/<int:pk>/', ProductCategoryView.as_view(), name='category-detail-update-delete'),
     path('api/products/', ProductView.as_view(), name='product-list'),
+    path('api/products/import/', ProductImportAPIView.as_view(), name='product-import'),
+    path('api/products/export/', ProductExportAPIView.as_view(), name='product-export'),
     path('api/products/<int:id>/', ProductDetailView.as_view(), name='product-detail'),
     path('schema/', schema_view),
     path('docs/', include_docs_urls(title='API Documentation')),
     path('api/shopping-cart/<int:user_id>/', ShoppingCartView.as_view(), name='shopping-cart-detail'),
     path('api/shopping-cart-items/cart/<int:cart_id>/', ShoppingCartItemListCreate.as_view(),
          name='shopping-cart-item-list-create'),
+    path('api/shopping-cart-items/cart/<int:cart_id>/batch/', ShoppingCartItemBatchAPIView.as_view(),
+         name='shopping-cart-item-batch'),
     path('api/search/products/', ProductSearchAPIView.as_view(), name='product-search'),
+    path('api/search/products/facets/', ProductFacetSearchAPIView.as_view(), name='product-facet-search'),
+    path('api/search/autocomplete/', ProductAutocompleteAPIView.as_view(), name='product-autocomplete'),
     path('api/shopping-cart-items/item/<int:pk>/', ShoppingCartItemByProductDetail.as_view(),
          name='shopping-cart-item-by-product-detail'),
     path('api/users/<int:user_id>/addresses/', AddressList.as_view(), name='address-list'),
@@ -49,6 +58,14 @@ urlpatterns = [
     path('api/users/<int:user_id>/orders/', UserOrderAPIView.as_view(), name='user-orders'),
     path('api/users/create/<int:user_id>/orders/', UserOrderCreateAPIView.as_view(), name='order-create'),
     path('api/users/<int:user_id>/orders/<int:pk>/', UserOrderOneAPIView.as_view(), name='user-order-detail'),
+    path('api/alipay/notify/', AliPayNotifyAPIView.as_view(), name='alipay-notify'),
     path('api/alipay/<int:user_id>/<int:pk>/', AliPayAPIView.as_view(), name='alipay'),
     path('api/manager/orders/', ManagerOrderOneAPIView.as_view(), name='manager-user-orders'),
+    path('api/manager/orders/status/', ManagerOrderBulkStatusAPIView.as_view(), name='manager-order-status'),
+    path('api/manager/dashboard/', ManagerSalesDashboardAPIView.as_view(), name='manager-sales-dashboard'),
+    path('api/manager/orders/exports/', OrderExportAPIView.as_view(), name='order-export'),
+    path('api/manager/orders/exports/<int:pk>/', OrderExportDetailAPIView.as_view(), name='order-export-detail'),
+    path('api/manager/orders/exports/<int:pk>/download/', OrderExportDownloadAPIView.as_view(),
+         name='order-export-download'),
+    path('api/cache/stats/', CatalogCacheStatsAPIView.as_view(), name='catalog-cache-stats'),
 ]